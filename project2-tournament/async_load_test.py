@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# async_load_test.py -- concurrent reportMatch load test of the async API
+#
+# Usage:
+#   python3 async_load_test.py [concurrent calls]
+#
+# Creates a scratch tournament in the database behind TOURNAMENT_ASYNC_DSN,
+# reports that many matches at the same time and prints p50/p99 latency.
+#
+
+import asyncio
+import sys
+import time
+
+import async_tournament
+
+
+def percentile(samples, fraction):
+    """Returns the value below which fraction of the sorted samples fall."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def timedReport(winner, loser, tournament):
+    """Report one match and return how long the call took."""
+    start = time.perf_counter()
+    await async_tournament.reportMatch(winner, loser, tournament)
+    return time.perf_counter() - start
+
+
+async def loadTest(calls):
+    """Drive calls concurrent reportMatch calls against a new tournament."""
+    pool = await async_tournament.getPool()
+    tournament = await pool.fetchval("SELECT create_tournament($1);",
+                                     'async load test')
+    try:
+        await pool.executemany(
+            "insert into player (name, tournament_id) values ($1, $2);",
+            [('Player %d' % i, tournament) for i in range(calls * 2)])
+        standings = await async_tournament.playerStandings(tournament)
+        ids = [row[0] for row in standings]
+        start = time.perf_counter()
+        durations = await asyncio.gather(*[
+            timedReport(ids[i], ids[i + 1], tournament)
+            for i in range(0, len(ids), 2)])
+        elapsed = time.perf_counter() - start
+    finally:
+        await pool.execute("SELECT drop_tournament($1);", tournament)
+        await async_tournament.closePool()
+    print('%d concurrent reportMatch calls in %.3f s (pool of %d)' % (
+        calls, elapsed, async_tournament.POOL_MAX_CONNECTIONS))
+    print('p50 %8.3f ms  p99 %8.3f ms' % (
+        percentile(durations, 0.5) * 1000, percentile(durations, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    asyncio.get_event_loop().run_until_complete(loadTest(calls))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# async_tournament.py -- asyncio counterpart of the tournament API
+#
+# Built on asyncpg, needs Python 3.5 or later. Every coroutine runs on a
+# connection from one pool shared by the whole event loop.
+#
+
+import asyncio
+import os
+
+import asyncpg
+import bleach
+
+import pairing
+from scoring import WIN, matchRow
+
+# Connection URL of the tournament database
+ASYNC_DSN = os.environ.get('TOURNAMENT_ASYNC_DSN', 'postgresql:///tournament')
+# Number of connections opened up front and kept open by the pool
+POOL_MIN_CONNECTIONS = int(os.environ.get('TOURNAMENT_POOL_MIN', 1))
+# Upper bound of connections the pool will ever open at once
+POOL_MAX_CONNECTIONS = int(os.environ.get('TOURNAMENT_POOL_MAX', 10))
+# Tournament created by tournament.sql, used when no tournament is given
+DEFAULT_TOURNAMENT = 1
+
+_pool = None
+_poolLock = None
+
+
+async def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool, _poolLock
+    if _pool is None:
+        # Created here so the lock belongs to the running event loop
+        if _poolLock is None:
+            _poolLock = asyncio.Lock()
+        async with _poolLock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    ASYNC_DSN, min_size=POOL_MIN_CONNECTIONS,
+                    max_size=POOL_MAX_CONNECTIONS)
+    return _pool
+
+
+async def closePool():
+    """Close the shared connection pool, a new one is opened on next use."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+async def countPlayers(tournament=DEFAULT_TOURNAMENT):
+    """Returns the number of players currently registered."""
+    pool = await getPool()
+    return await pool.fetchval(
+        "select count(*) from Player where tournament_id = $1;", tournament)
+
+
+async def registerPlayer(name, tournament=DEFAULT_TOURNAMENT):
+    """Adds a player to the tournament database.
+
+    Args:
+      name: the player's full name (need not be unique).
+      tournament: the id of the tournament the player registers for
+    """
+    pool = await getPool()
+    await pool.execute(
+        "insert into player (name, tournament_id) values ($1, $2);",
+        bleach.clean(name, strip=True), tournament)
+
+
+async def playerStandings(tournament=DEFAULT_TOURNAMENT):
+    """Returns a list of the players and their win records, sorted by wins.
+
+    Returns:
+      A list of tuples, each of which contains (id, name, wins, matches),
+      see tournament.playerStandings.
+    """
+    pool = await getPool()
+    rows = await pool.fetch(
+        """SELECT p.id, p.name, s.won, s.played
+           FROM Standing AS s JOIN Player AS p ON p.id = s.player_id
+           WHERE s.tournament_id = $1
+           ORDER BY s.points DESC, s.won DESC;""", tournament)
+    return [tuple(row) for row in rows]
+
+
+async def reportMatch(winner, loser, tournament=DEFAULT_TOURNAMENT,
+                      result=WIN, games=None):
+    """Records the outcome of a single match between two players.
+
+    Args:
+      winner:  the id number of the player who won
+      loser:  the id number of the player who lost, None for a bye
+      tournament: the id of the tournament both players registered for
+      result: WIN, DRAW or BYE, see tournament.reportMatch
+      games: optional (winner_games, loser_games) score of a multi-game match
+    """
+    pool = await getPool()
+    await pool.execute(
+        """INSERT INTO Match (winner, loser, result, winner_games,
+                              loser_games, tournament_id)
+           VALUES ($1, $2, $3, $4, $5, $6);""",
+        *(matchRow(winner, loser, result, games) + (tournament,)))
+
+
+async def swissPairings(tournament=DEFAULT_TOURNAMENT):
+    """Returns a list of pairs of players for the next round of a match.
+
+    Pairs the same way as tournament.swissPairings, the standings and the
+    opponent history are fetched concurrently.
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2),
+      with None for the opponent of a player getting a bye.
+    """
+    pool = await getPool()
+    standings, matches = await asyncio.gather(
+        playerStandings(tournament),
+        pool.fetch("""SELECT winner, loser, result FROM Match
+                      WHERE tournament_id = $1;""", tournament))
+    history = [tuple(row) for row in matches]
+    return pairing.pairStandings(standings, pairing.opponentSets(history),
+                                 pairing.byeSet(history))
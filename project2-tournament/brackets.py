@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# brackets.py -- single elimination and round-robin schedules
+#
+
+from scoring import WIN
+
+
+def seedOrder(size):
+    """Returns the seeds 1 to size in bracket order.
+
+    Neighbours meet in the first round and the top seeds can only meet in
+    the later rounds, e.g. 1, 8, 4, 5, 2, 7, 3, 6 for eight players.
+
+    Args:
+      size: number of bracket slots, a power of two
+    """
+    order = [1]
+    while len(order) < size:
+        slots = 2 * len(order)
+        order = [seed for top in order for seed in (top, slots + 1 - top)]
+    return order
+
+
+def seedBracket(players):
+    """Pairs the first round of a single elimination bracket.
+
+    The bracket has the next power of two slots, the seeds missing from it
+    are byes for the top seeds.
+
+    Args:
+      players: list of player ids, best seed first
+
+    Returns:
+      A list of (id1, id2) tuples in bracket order, id2 is None for a bye.
+
+    Raises:
+      ValueError: if there are fewer than two players
+    """
+    if len(players) < 2:
+        raise ValueError('a bracket needs at least two players, got %d' %
+                         len(players))
+    size = 1
+    while size < len(players):
+        size *= 2
+    order = seedOrder(size)
+    seeded = [players[seed - 1] if seed <= len(players) else None
+              for seed in order]
+    return [(seeded[i], seeded[i + 1]) for i in range(0, len(seeded), 2)]
+
+
+def nextRound(pairs, matches):
+    """Pairs the winners of one elimination round for the next one.
+
+    Args:
+      pairs: list of (id1, id2) tuples of the round in bracket order, id2
+        None for a bye
+      matches: list of (winner, loser, result) tuples reported since the
+        round was scheduled
+
+    Returns:
+      A list of (id1, id2) tuples, empty after the final.
+
+    Raises:
+      ValueError: if a match of the round has not been won yet
+    """
+    beaten = dict((loser, winner) for winner, loser, result in matches
+                  if result == WIN)
+    winners = []
+    for player1, player2 in pairs:
+        if player2 is None or beaten.get(player2) == player1:
+            winners.append(player1)
+        elif beaten.get(player1) == player2:
+            winners.append(player2)
+        else:
+            raise ValueError('the match of %r against %r has no winner yet'
+                             % (player1, player2))
+    return [(winners[i], winners[i + 1])
+            for i in range(0, len(winners) - 1, 2)]
+
+
+def roundRobin(players):
+    """Schedules every player against every other one by the circle method.
+
+    The first player stays in place while the others rotate by one slot
+    per round, so the n * (n - 1) / 2 pairings are generated in O(n^2)
+    without any search.
+
+    Args:
+      players: list of player ids
+
+    Returns:
+      A list of rounds, each a list of (id1, id2) tuples. With an odd
+      number of players id2 is None for the player sitting the round out.
+    """
+    circle = list(players)
+    if len(circle) % 2:
+        circle.append(None)
+    count = len(circle)
+    rounds = []
+    for _ in range(count - 1):
+        pairs = []
+        for i in range(count // 2):
+            player1, player2 = circle[i], circle[count - 1 - i]
+            if player1 is None:
+                player1, player2 = player2, player1
+            pairs.append((player1, player2))
+        rounds.append(pairs)
+        # Rotate every player but the first one slot further
+        circle.insert(1, circle.pop())
+    return rounds
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# event_log.py -- replay of the tournament event log onto a snapshot
+#
+
+from scoring import BYE, DRAW, MATCH_POINTS
+
+# Kinds of events in the Tournament_Event log
+PLAYER_REGISTERED = 'player_registered'
+PLAYER_REMOVED = 'player_removed'
+MATCH_REPORTED = 'match_reported'
+MATCH_VOIDED = 'match_voided'
+MATCHES_CLEARED = 'matches_cleared'
+
+
+def replay(snapshot, events):
+    """Rebuilds standings by applying events on top of a snapshot.
+
+    Only the events after the snapshot have to be replayed, so the cost is
+    O(players + events since the snapshot).
+
+    Args:
+      snapshot: list of [id, name, wins, matches, draws, points] rows, or
+        None to replay from an empty tournament
+      events: list of (kind, player_id, name, winner, loser, result)
+        tuples in log order
+
+    Returns:
+      A list of (id, name, wins, matches, draws, points) tuples, ranked by
+      points and wins like playerStandings.
+    """
+    standings = dict((row[0], list(row[1:])) for row in snapshot or ())
+    for kind, player, name, winner, loser, result in events:
+        if kind == PLAYER_REGISTERED:
+            standings[player] = [name, 0, 0, 0, 0]
+        elif kind == PLAYER_REMOVED:
+            standings.pop(player, None)
+        elif kind == MATCHES_CLEARED:
+            for record in standings.values():
+                record[1:] = [0, 0, 0, 0]
+        elif kind == MATCH_REPORTED:
+            _applyMatch(standings, winner, loser, result, 1)
+        elif kind == MATCH_VOIDED:
+            _applyMatch(standings, winner, loser, result, -1)
+    rows = [tuple([player] + record) for player, record in standings.items()]
+    rows.sort(key=lambda row: (-row[5], -row[2]))
+    return rows
+
+
+def _applyMatch(standings, winner, loser, result, change):
+    """Adds (change 1) or removes (change -1) a match from the standings."""
+    winnerPoints, loserPoints = MATCH_POINTS[result]
+    winnerRecord = standings[winner]
+    winnerRecord[2] += change
+    winnerRecord[4] += winnerPoints * change
+    if result == DRAW:
+        winnerRecord[3] += change
+        standings[loser][3] += change
+    else:
+        winnerRecord[1] += change
+    if result != BYE:
+        standings[loser][2] += change
+        standings[loser][4] += loserPoints * change
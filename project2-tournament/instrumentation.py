@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# instrumentation.py -- hooks observing every query of the tournament API
+#
+# tournament.executeQuery reports every statement it runs to the hooks
+# added here, e.g. to collect per statement counters and export them:
+#
+#   stats = instrumentation.QueryStats()
+#   instrumentation.addHook(stats)
+#   ...
+#   print stats.prometheusText()
+#
+
+import sys
+import threading
+from collections import namedtuple
+
+# What a hook is called with for every executed statement
+#   function: name of the tournament function that ran the statement
+#   statement: the SQL text with its whitespace collapsed
+#   duration: seconds spent executing and committing the statement
+#   acquireTime: seconds spent waiting for a pooled connection
+#   rows: rows fetched, or affected for statements without results
+#   error: the exception the statement failed with, None on success
+QueryEvent = namedtuple('QueryEvent', ['function', 'statement', 'duration',
+                                       'acquireTime', 'rows', 'error'])
+
+# Hooks called with a QueryEvent after every statement, in order
+hooks = []
+
+
+def addHook(hook):
+    """Calls hook with a QueryEvent after every statement executed."""
+    hooks.append(hook)
+
+
+def removeHook(hook):
+    """Stops calling a hook added with addHook."""
+    hooks.remove(hook)
+
+
+def notify(event):
+    """Hands a QueryEvent to every hook."""
+    for hook in list(hooks):
+        hook(event)
+
+
+def normalizeStatement(query):
+    """Collapses the whitespace of a query into single spaces."""
+    return ' '.join(query.split())
+
+
+class QueryStats(object):
+    """Hook counting calls, rows, time and errors per function and statement.
+
+    Thread safe, one instance can be shared by every thread of a process.
+    """
+
+    # Prometheus metric names and help texts, in the order of the counters
+    METRICS = (
+        ('tournament_query_calls_total', 'Statements executed.'),
+        ('tournament_query_errors_total', 'Statements that failed.'),
+        ('tournament_query_rows_total', 'Rows fetched or affected.'),
+        ('tournament_query_seconds_total',
+         'Seconds spent executing statements.'),
+        ('tournament_query_acquire_seconds_total',
+         'Seconds spent waiting for a pooled connection.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def __call__(self, event):
+        key = (event.function or '', event.statement)
+        with self._lock:
+            counters = self._counters.setdefault(key, [0, 0, 0, 0.0, 0.0])
+            counters[0] += 1
+            counters[1] += event.error is not None
+            counters[2] += max(event.rows, 0)
+            counters[3] += event.duration
+            counters[4] += event.acquireTime
+
+    def counters(self):
+        """Returns the counters collected so far.
+
+        Returns:
+          A dict mapping (function, statement) to a tuple of (calls, errors,
+          rows, seconds, acquireSeconds).
+        """
+        with self._lock:
+            return dict((key, tuple(counters))
+                        for key, counters in self._counters.items())
+
+    def reset(self):
+        """Sets every counter back to zero."""
+        with self._lock:
+            self._counters.clear()
+
+    def prometheusText(self):
+        """Returns the counters in the Prometheus text exposition format."""
+        counters = sorted(self.counters().items())
+        lines = []
+        for column, (metric, description) in enumerate(self.METRICS):
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s counter' % metric)
+            for (function, statement), values in counters:
+                lines.append('%s{function="%s",statement="%s"} %s' % (
+                    metric, _labelValue(function), _labelValue(statement),
+                    repr(values[column])))
+        return '\n'.join(lines) + '\n'
+
+
+class SlowQueryLog(object):
+    """Hook writing every statement slower than threshold seconds to stream.
+
+    Args:
+      threshold: seconds a statement may take before it is logged
+      stream: file the log lines are written to, stderr by default
+    """
+
+    def __init__(self, threshold, stream=None):
+        self.threshold = threshold
+        self.stream = stream
+
+    def __call__(self, event):
+        if event.duration < self.threshold:
+            return
+        stream = self.stream or sys.stderr
+        stream.write('slow query %.1f ms (waited %.1f ms, %d rows) in %s: '
+                     '%s\n' % (event.duration * 1000, event.acquireTime * 1000,
+                               event.rows, event.function, event.statement))
+
+
+def _labelValue(value):
+    """Escapes a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+#
+# memory_backend.py -- in-memory storage backend of the tournament API
+#
+# Keeps every tournament in compact arrays instead of PostgreSQL, for
+# simulations and for running tournament_test.py without a database:
+#
+#   tournament.setBackend(memory_backend.MemoryBackend())
+#
+
+from array import array
+
+import brackets
+import event_log
+import pairing
+import ratings as rating
+import tiebreaks as tiebreak
+from scoring import BYE, DRAW, MATCH_POINTS, RESULTS, WIN, matchRow
+
+# Tournament every backend starts with, used when no tournament is given
+DEFAULT_TOURNAMENT = 1
+# Logged events after which reportMatches snapshots the standings
+SNAPSHOT_INTERVAL = 1000
+# Rows per batch yielded by streamStandings
+STREAM_BATCH_SIZE = 1000
+# Stands in for a missing loser or games score in the match columns
+_NONE = -1
+
+
+class _Event(object):
+    """Players and matches of one tournament, stored column wise."""
+
+    def __init__(self, name):
+        self.name = name
+        # Player columns, one position per registered player
+        self.ids = array('l')
+        self.names = []
+        self.wins = array('l')
+        self.played = array('l')
+        self.draws = array('l')
+        self.points = array('l')
+        self.ratings = array('d')
+        self.initialRatings = array('d')
+        # Maps a player id to its position in the player columns
+        self.positions = {}
+        # Match columns, one position per reported match, results are
+        # stored as their index in scoring.RESULTS
+        self.winners = array('l')
+        self.losers = array('l')
+        self.results = array('b')
+        self.winnerGames = array('l')
+        self.loserGames = array('l')
+        self.matchIds = array('l')
+        self.ratingChanges = array('d')
+        # Event log as (id, kind, player_id, name, winner, loser, result)
+        # tuples and standings snapshots as (event id, rows) tuples
+        self.log = []
+        self.snapshots = []
+        # Scheduled pairings as (round, id1, id2, since match id) tuples
+        self.schedule = []
+
+
+class MemoryBackend(object):
+    """Tournament storage in process memory, mirroring the PostgreSQL API.
+
+    Every method takes the same arguments as the tournament function of
+    the same name. Player ids are unique across all tournaments of the
+    backend, like the serial ids of the database.
+    """
+
+    def __init__(self):
+        self._events = {}
+        self._nextTournament = DEFAULT_TOURNAMENT
+        self._nextPlayer = 1
+        self._nextMatch = 1
+        self._nextEvent = 1
+        self.createTournament('Default')
+
+    def createTournament(self, name):
+        tournament = self._nextTournament
+        self._nextTournament += 1
+        self._events[tournament] = _Event(name)
+        return tournament
+
+    def deleteTournament(self, tournament):
+        self._events.pop(tournament, None)
+
+    def deleteMatches(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._event(tournament)
+        event.winners = array('l')
+        event.losers = array('l')
+        event.results = array('b')
+        event.winnerGames = array('l')
+        event.loserGames = array('l')
+        event.matchIds = array('l')
+        event.ratingChanges = array('d')
+        (event.wins, event.played, event.draws,
+         event.points) = self._countMatches(event)
+        event.ratings = array('d', event.initialRatings)
+        self._logEvent(event, event_log.MATCHES_CLEARED)
+
+    def deletePlayers(self, tournament=DEFAULT_TOURNAMENT):
+        if tournament not in self._events:
+            return
+        event = self._events[tournament]
+        if len(event.winners):
+            raise ValueError('players with recorded matches cannot be '
+                             'deleted, delete the matches first')
+        for player, name in zip(event.ids, event.names):
+            self._logEvent(event, event_log.PLAYER_REMOVED, player, name)
+        # The log outlives the players, like the Tournament_Event table
+        self._events[tournament] = _Event(event.name)
+        self._events[tournament].log = event.log
+        self._events[tournament].snapshots = event.snapshots
+
+    def countPlayers(self, tournament=DEFAULT_TOURNAMENT):
+        return len(self._readEvent(tournament).ids)
+
+    def registerPlayer(self, name, tournament=DEFAULT_TOURNAMENT,
+                       initialRating=rating.INITIAL_RATING):
+        self.registerPlayers([name], tournament, [initialRating])
+
+    def registerPlayers(self, names, tournament=DEFAULT_TOURNAMENT,
+                        initialRatings=None):
+        event = self._event(tournament)
+        names = list(names)
+        ratings = rating.startingRatings(len(names), initialRatings)
+        for name, playerRating in zip(names, ratings):
+            event.positions[self._nextPlayer] = len(event.ids)
+            event.ids.append(self._nextPlayer)
+            event.names.append(name)
+            event.wins.append(0)
+            event.played.append(0)
+            event.draws.append(0)
+            event.points.append(0)
+            event.ratings.append(playerRating)
+            event.initialRatings.append(playerRating)
+            self._logEvent(event, event_log.PLAYER_REGISTERED,
+                           self._nextPlayer, name)
+            self._nextPlayer += 1
+
+    def playerStandings(self, tournament=DEFAULT_TOURNAMENT, tiebreaks=None):
+        event = self._readEvent(tournament)
+        order = sorted(range(len(event.ids)),
+                       key=lambda i: (event.points[i], event.wins[i]),
+                       reverse=True)
+        results = [(event.ids[i], event.names[i], event.wins[i],
+                    event.played[i]) for i in order]
+        if tiebreaks is None:
+            return results
+        return tiebreak.rankStandings(results, self.matchHistory(tournament),
+                                      tiebreaks)
+
+    def streamStandings(self, tournament=DEFAULT_TOURNAMENT,
+                        batchSize=STREAM_BATCH_SIZE):
+        standings = self.playerStandings(tournament)
+        for start in range(0, len(standings), batchSize):
+            yield standings[start:start + batchSize]
+
+    def checkStandings(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._readEvent(tournament)
+        stored = list(zip(event.wins, event.played, event.draws,
+                          event.points))
+        counted = list(zip(*self._countMatches(event)))
+        return [(event.ids[i],) + stored[i] + counted[i]
+                for i in range(len(event.ids)) if stored[i] != counted[i]]
+
+    def rebuildStandings(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._event(tournament)
+        (event.wins, event.played, event.draws,
+         event.points) = self._countMatches(event)
+
+    def reportMatch(self, winner, loser, tournament=DEFAULT_TOURNAMENT,
+                    result=WIN, games=None):
+        return self.reportMatches([(winner, loser, result, games)],
+                                  tournament)[0]
+
+    def reportMatches(self, results, tournament=DEFAULT_TOURNAMENT):
+        event = self._event(tournament)
+        rows = [matchRow(*match) for match in results]
+        positions = [(self._position(event, winner),
+                      None if loser is None else self._position(event, loser))
+                     for winner, loser, result, games, opponentGames in rows]
+        # Every match was validated, record the whole round
+        ids = []
+        for (winner, loser, result, winnerGames, loserGames), \
+                (winnerAt, loserAt) in zip(rows, positions):
+            event.winners.append(winner)
+            event.losers.append(_NONE if loser is None else loser)
+            event.results.append(RESULTS.index(result))
+            event.winnerGames.append(
+                _NONE if winnerGames is None else winnerGames)
+            event.loserGames.append(
+                _NONE if loserGames is None else loserGames)
+            event.matchIds.append(self._nextMatch)
+            ids.append(self._nextMatch)
+            self._nextMatch += 1
+            self._applyMatch(event, winnerAt, loserAt, result)
+            change = 0.0
+            if result != BYE:
+                change = rating.eloChange(event.ratings[winnerAt],
+                                          event.ratings[loserAt], result)
+                event.ratings[winnerAt] += change
+                event.ratings[loserAt] -= change
+            event.ratingChanges.append(change)
+            self._logEvent(event, event_log.MATCH_REPORTED, winner=winner,
+                           loser=loser, result=result)
+        self.snapshotStandings(tournament, SNAPSHOT_INTERVAL)
+        return ids
+
+    def voidMatch(self, match, tournament=DEFAULT_TOURNAMENT):
+        event = self._event(tournament)
+        try:
+            index = event.matchIds.index(match)
+        except ValueError:
+            return
+        winner, loser = event.winners[index], event.losers[index]
+        result = RESULTS[event.results[index]]
+        change = event.ratingChanges[index]
+        if result != BYE:
+            event.ratings[event.positions[winner]] -= change
+            event.ratings[event.positions[loser]] += change
+        for column in (event.winners, event.losers, event.results,
+                       event.winnerGames, event.loserGames, event.matchIds,
+                       event.ratingChanges):
+            del column[index]
+        (event.wins, event.played, event.draws,
+         event.points) = self._countMatches(event)
+        self._logEvent(event, event_log.MATCH_VOIDED, winner=winner,
+                       loser=None if loser == _NONE else loser, result=result)
+        self.snapshotStandings(tournament, SNAPSHOT_INTERVAL)
+
+    def lastEvent(self, tournament=DEFAULT_TOURNAMENT):
+        log = self._readEvent(tournament).log
+        return log[-1][0] if log else None
+
+    def snapshotStandings(self, tournament=DEFAULT_TOURNAMENT, minEvents=1):
+        event = self._event(tournament)
+        since = event.snapshots[-1][0] if event.snapshots else 0
+        # Count the events since the snapshot from the end of the log
+        count = 0
+        for entry in reversed(event.log):
+            if entry[0] <= since:
+                break
+            count += 1
+        if count < max(minEvents, 1):
+            return
+        rows = [(event.ids[i], event.names[i], event.wins[i],
+                 event.played[i], event.draws[i], event.points[i])
+                for i in range(len(event.ids))]
+        event.snapshots.append((event.log[-1][0], rows))
+
+    def standingsAt(self, tournament=DEFAULT_TOURNAMENT, event=None):
+        stored = self._readEvent(tournament)
+        since, snapshot = 0, None
+        for snapshotEvent, rows in stored.snapshots:
+            if event is None or snapshotEvent <= event:
+                since, snapshot = snapshotEvent, rows
+        events = [entry[1:] for entry in stored.log if entry[0] > since and
+                  (event is None or entry[0] <= event)]
+        return [row[:4] for row in event_log.replay(snapshot, events)]
+
+    def matchHistory(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._readEvent(tournament)
+        return [(winner, None if loser == _NONE else loser, RESULTS[result])
+                for winner, loser, result
+                in zip(event.winners, event.losers, event.results)]
+
+    def opponentHistory(self, tournament=DEFAULT_TOURNAMENT):
+        return pairing.opponentSets(self.matchHistory(tournament))
+
+    def playerRatings(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._readEvent(tournament)
+        return sorted(zip(event.ids, event.names, event.ratings),
+                      key=lambda row: (-row[2], row[0]))
+
+    def recomputeRatings(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._event(tournament)
+        ratings, changes = rating.batchRatings(
+            dict(zip(event.ids, event.initialRatings)),
+            self.matchHistory(tournament))
+        event.ratings = array('d', [ratings[player] for player in event.ids])
+        event.ratingChanges = array('d', changes)
+
+    def swissPairings(self, tournament=DEFAULT_TOURNAMENT,
+                      seedByRating=False):
+        history = self.matchHistory(tournament)
+        if seedByRating and not history:
+            standings = pairing.seededOrder(self.playerRatings(tournament))
+        else:
+            standings = self.playerStandings(tournament)
+        return pairing.pairStandings(standings, pairing.opponentSets(history),
+                                     pairing.byeSet(history))
+
+    def scheduleElimination(self, tournament=DEFAULT_TOURNAMENT, size=None):
+        players = [row[0] for row in self.playerStandings(tournament)][:size]
+        return self._storeSchedule(tournament,
+                                   [brackets.seedBracket(players)])
+
+    def advanceElimination(self, tournament=DEFAULT_TOURNAMENT):
+        event = self._readEvent(tournament)
+        if not event.schedule:
+            raise ValueError('no elimination bracket is scheduled for '
+                             'tournament %r' % (tournament,))
+        last, since = event.schedule[-1][0], event.schedule[-1][3]
+        matches = [match for match, matchId
+                   in zip(self.matchHistory(tournament), event.matchIds)
+                   if matchId > since]
+        pairs = brackets.nextRound(
+            [(id1, id2) for round, id1, id2, _ in event.schedule
+             if round == last], matches)
+        if not pairs:
+            return []
+        return self._storeSchedule(tournament, [pairs], last + 1)
+
+    def scheduleRoundRobin(self, tournament=DEFAULT_TOURNAMENT):
+        players = sorted(self._readEvent(tournament).ids)
+        return self._storeSchedule(tournament, brackets.roundRobin(players))
+
+    def scheduledPairings(self, tournament=DEFAULT_TOURNAMENT, round=None):
+        return [(number, id1, id2)
+                for number, id1, id2, _ in self._readEvent(tournament).schedule
+                if round is None or number == round]
+
+    def _storeSchedule(self, tournament, rounds, firstRound=1):
+        """Stores rounds of (id1, id2) pairs, see tournament.storeSchedule."""
+        event = self._event(tournament)
+        since = max(event.matchIds) if len(event.matchIds) else 0
+        schedule = [(firstRound + number, id1, id2)
+                    for number, pairs in enumerate(rounds)
+                    for id1, id2 in pairs]
+        if firstRound == 1:
+            event.schedule = []
+        event.schedule.extend(row + (since,) for row in schedule)
+        return schedule
+
+    def _readEvent(self, tournament):
+        """Returns the event, or an empty one if there is no such event."""
+        return self._events.get(tournament) or _Event(None)
+
+    def _event(self, tournament):
+        try:
+            return self._events[tournament]
+        except KeyError:
+            raise ValueError('unknown tournament %r' % (tournament,))
+
+    def _logEvent(self, event, kind, player=None, name=None, winner=None,
+                  loser=None, result=None):
+        """Appends an entry to the event log of the event."""
+        event.log.append((self._nextEvent, kind, player, name, winner, loser,
+                          result))
+        self._nextEvent += 1
+
+    def _position(self, event, player):
+        """Returns the column position of a player id of the event."""
+        try:
+            return event.positions[int(player)]
+        except (TypeError, ValueError):
+            raise ValueError('player id must be an integer, got %r' %
+                             (player,))
+        except KeyError:
+            raise ValueError('player %r is not registered for this '
+                             'tournament' % (player,))
+
+    def _applyMatch(self, event, winner, loser, result, columns=None):
+        """Adds a match to the standings columns of the given positions."""
+        wins, played, draws, points = columns or (
+            event.wins, event.played, event.draws, event.points)
+        winnerPoints, loserPoints = MATCH_POINTS[result]
+        played[winner] += 1
+        points[winner] += winnerPoints
+        if result == DRAW:
+            draws[winner] += 1
+            draws[loser] += 1
+        else:
+            wins[winner] += 1
+        if result != BYE:
+            played[loser] += 1
+            points[loser] += loserPoints
+
+    def _countMatches(self, event):
+        """Recounts the standings columns from the match columns.
+
+        Returns:
+          A tuple of (wins, played, draws, points) arrays by position.
+        """
+        count = len(event.ids)
+        columns = tuple(array('l', [0]) * count for _ in range(4))
+        for winner, loser, result in zip(event.winners, event.losers,
+                                         event.results):
+            self._applyMatch(
+                event, event.positions[winner],
+                None if loser == _NONE else event.positions[loser],
+                RESULTS[result], columns)
+        return columns
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# pairing.py -- rematch avoiding Swiss pairing engine
+#
+
+from scoring import BYE
+
+# Backtracking steps allowed before falling back to greedy pairing
+MAX_BACKTRACKS = 100000
+
+_NO_OPPONENTS = frozenset()
+
+
+def pairPlayers(players, opponents, byes=(), maxBacktracks=MAX_BACKTRACKS):
+    """Pairs players for the next round without rematches.
+
+    Players are paired top down: the highest ranked unpaired player is
+    matched with the closest ranked player it has not played yet, so score
+    groups stay together and only float down when every opponent left in
+    the group has been played already. Dead ends are undone by backtracking
+    to the previous pair. If no rematch free pairing is found within
+    maxBacktracks steps, rematches are allowed for the players that cannot
+    be paired otherwise.
+
+    Args:
+      players: list of player ids, ordered by standings
+      opponents: dict mapping a player id to the set of ids it has played
+      byes: ids of players that already had a bye
+      maxBacktracks: backtracking steps allowed before falling back
+
+    Returns:
+      A tuple (pairs, bye)
+        pairs: list of (id1, id2) tuples, in standings order
+        bye: id of the player getting a bye, None for an even player count
+    """
+    remaining = list(players)
+    bye = None
+    if len(remaining) % 2:
+        bye = _byePlayer(remaining, byes)
+        remaining.remove(bye)
+    pairs = _backtrackPairs(remaining, opponents, maxBacktracks)
+    if pairs is None:
+        pairs = _greedyPairs(remaining, opponents)
+    return pairs, bye
+
+
+def pairStandings(standings, opponents, byes=()):
+    """Pairs standings rows for the next round, see pairPlayers.
+
+    Args:
+      standings: list of standings rows starting with (id, name, ...)
+      opponents: dict mapping a player id to the set of ids it has played
+      byes: ids of players that already had a bye
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2),
+      the player getting a bye comes last with None as opponent.
+    """
+    names = dict((row[0], row[1]) for row in standings)
+    pairs, bye = pairPlayers([row[0] for row in standings], opponents, byes)
+    pairings = [(id1, names[id1], id2, names[id2]) for id1, id2 in pairs]
+    if bye is not None:
+        pairings.append((bye, names[bye], None, None))
+    return pairings
+
+
+def seededOrder(rows):
+    """Orders rated players so pairing them seeds a first round.
+
+    Pairs are made from neighbours, so the top half of the players is
+    interleaved with the bottom half: the highest rated player meets the
+    highest rated one of the bottom half and so on. With an odd number of
+    players the lowest rated one comes last and gets the bye.
+
+    Args:
+      rows: list of (id, name, rating, ...) rows, highest rating first
+
+    Returns:
+      The rows in pairing order.
+    """
+    rows = list(rows)
+    last = [rows.pop()] if len(rows) % 2 else []
+    half = len(rows) // 2
+    order = []
+    for top, bottom in zip(rows[:half], rows[half:]):
+        order.extend((top, bottom))
+    return order + last
+
+
+def opponentSets(matches):
+    """Builds the opponent adjacency sets from (player1, player2, ...) rows."""
+    opponents = {}
+    for match in matches:
+        player1, player2 = match[0], match[1]
+        if player1 is None or player2 is None:
+            continue
+        opponents.setdefault(player1, set()).add(player2)
+        opponents.setdefault(player2, set()).add(player1)
+    return opponents
+
+
+def byeSet(matches):
+    """Returns the ids of players with a bye in (winner, loser, result)."""
+    return set(winner for winner, loser, result in matches if result == BYE)
+
+
+def _byePlayer(players, byes):
+    """Returns the lowest ranked player that did not have a bye yet."""
+    for player in reversed(players):
+        if player not in byes:
+            return player
+    # Everybody had a bye already, start over from the bottom
+    return players[-1]
+
+
+def _backtrackPairs(players, opponents, maxBacktracks):
+    """Returns rematch free pairs or None when the budget runs out."""
+    remaining = list(players)
+    # Every pair made so far as (player1, player2, index of player2)
+    stack = []
+    start = 1
+    backtracks = 0
+    while remaining:
+        top = remaining[0]
+        played = opponents.get(top, _NO_OPPONENTS)
+        index = start
+        while index < len(remaining) and remaining[index] in played:
+            index += 1
+        if index < len(remaining):
+            opponent = remaining[index]
+            del remaining[index]
+            del remaining[0]
+            stack.append((top, opponent, index))
+            start = 1
+            continue
+        # Dead end, undo the previous pair and try its next candidate
+        if not stack or backtracks >= maxBacktracks:
+            return None
+        backtracks += 1
+        top, opponent, index = stack.pop()
+        remaining.insert(0, top)
+        remaining.insert(index, opponent)
+        start = index + 1
+    return [(player1, player2) for player1, player2, index in stack]
+
+
+def _greedyPairs(players, opponents):
+    """Pairs top down with the closest unplayed opponent, else the next."""
+    remaining = list(players)
+    pairs = []
+    while remaining:
+        top = remaining.pop(0)
+        played = opponents.get(top, _NO_OPPONENTS)
+        index = 0
+        while index < len(remaining) and remaining[index] in played:
+            index += 1
+        if index == len(remaining):
+            # Only rematches are left, take the closest ranked player
+            index = 0
+        pairs.append((top, remaining.pop(index)))
+    return pairs
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# pairing_runner.py -- pair many tournaments at once on a process pool
+#
+# Usage:
+#   python pairing_runner.py [--workers N] tournament ...
+#
+# Every worker process holds its own database connection, a tournament
+# that fails is retried on its own while the others carry on.
+#
+
+import multiprocessing
+import sys
+import time
+from collections import namedtuple
+
+import tournament
+
+# Attempts after the first one for a tournament whose pairing failed
+MAX_RETRIES = 2
+# Seconds to wait before retrying, doubled with every attempt
+RETRY_DELAY = 0.5
+
+# Outcome of pairing one tournament
+#   tournament: the id of the tournament
+#   pairings: the swissPairings result, None if every attempt failed
+#   seconds: time spent on the successful or last attempt
+#   attempts: number of attempts made
+#   error: description of the last failure, None on success
+PairingResult = namedtuple('PairingResult', ['tournament', 'pairings',
+                                             'seconds', 'attempts', 'error'])
+
+
+def initWorker():
+    """Gives a freshly forked worker a single connection of its own."""
+    tournament.resetPool()
+    tournament.POOL_MIN_CONNECTIONS = tournament.POOL_MAX_CONNECTIONS = 1
+
+
+def pairTournament(event, retries=MAX_RETRIES, seedByRating=False):
+    """Pairs one tournament, retrying failed attempts.
+
+    A failed attempt closes the worker's connection, so the next one starts
+    on a fresh connection.
+
+    Returns:
+      A PairingResult, failures are reported in it instead of raised.
+    """
+    error = None
+    for attempt in range(1, retries + 2):
+        if attempt > 1:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 2))
+        start = time.time()
+        try:
+            pairings = tournament.swissPairings(event, seedByRating)
+            return PairingResult(event, pairings, time.time() - start,
+                                 attempt, None)
+        except Exception, failure:
+            error = '%s: %s' % (type(failure).__name__, failure)
+            tournament.closePool()
+    return PairingResult(event, None, time.time() - start, attempt, error)
+
+
+def _pairTask(task):
+    """pairTournament for a (tournament, retries, seedByRating) task."""
+    return pairTournament(*task)
+
+
+def pairTournaments(events, workers=None, retries=MAX_RETRIES,
+                    seedByRating=False):
+    """Pairs the next round of many tournaments concurrently.
+
+    Args:
+      events: ids of the tournaments to pair
+      workers: number of worker processes, one per CPU by default
+      retries: attempts after the first one for a failing tournament
+      seedByRating: passed on to swissPairings
+
+    Returns:
+      A list of PairingResult, in the order of events.
+    """
+    events = list(events)
+    pool = multiprocessing.Pool(workers, initializer=initWorker)
+    try:
+        results = pool.map(_pairTask, [(event, retries, seedByRating)
+                                       for event in events], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def report(results, seconds):
+    """Prints per tournament timing and a summary of a pairTournaments run."""
+    for result in results:
+        if result.error is None:
+            print '%6d  %4d pairs  %8.3f s  %d attempt(s)' % (
+                result.tournament, len(result.pairings), result.seconds,
+                result.attempts)
+        else:
+            print '%6d  FAILED after %d attempt(s): %s' % (
+                result.tournament, result.attempts, result.error)
+    paired = [result for result in results if result.error is None]
+    print '%d of %d tournaments paired in %.3f s, %.3f s of pairing work' % (
+        len(paired), len(results), seconds,
+        sum(result.seconds for result in paired))
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    workers = None
+    if arguments[:1] == ['--workers']:
+        workers = int(arguments[1])
+        arguments = arguments[2:]
+    if not arguments:
+        sys.exit('usage: pairing_runner.py [--workers N] tournament ...')
+    start = time.time()
+    results = pairTournaments([int(event) for event in arguments], workers)
+    report(results, time.time() - start)
+    if any(result.error is not None for result in results):
+        sys.exit(1)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo ratings updated per match and recomputed per season
+#
+
+from scoring import BYE, DRAW
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Rating of a player registered without one
+INITIAL_RATING = 1500.0
+# Most points a single match moves a rating by, elo_change in
+# tournament.sql uses the same value
+ELO_K = 32
+# Rating difference at which the stronger player is expected to score 10:1
+ELO_SCALE = 400.0
+
+
+def expectedScore(rating, opponentRating):
+    """Returns the score a player is expected to make against an opponent."""
+    return 1 / (1 + 10 ** ((opponentRating - rating) / ELO_SCALE))
+
+
+def startingRatings(count, initialRatings=None):
+    """Returns the ratings of count newly registered players.
+
+    Args:
+      count: number of players registered
+      initialRatings: optional list of their ratings, INITIAL_RATING for
+        every player when None
+
+    Raises:
+      ValueError: if initialRatings does not hold one rating per player
+    """
+    if initialRatings is None:
+        return [INITIAL_RATING] * count
+    initialRatings = list(initialRatings)
+    if len(initialRatings) != count:
+        raise ValueError('%d initial ratings given for %d players' %
+                         (len(initialRatings), count))
+    return initialRatings
+
+
+def eloChange(winnerRating, loserRating, result, k=ELO_K):
+    """Returns the rating points the loser of a match passes to the winner.
+
+    Negative when the winner of a draw was the higher rated player. Byes do
+    not change ratings.
+
+    Args:
+      winnerRating: the winner's rating before the match
+      loserRating: the loser's rating before the match
+      result: WIN, DRAW or BYE, see scoring.RESULTS
+      k: most points a match moves a rating by
+    """
+    if result == BYE:
+        return 0.0
+    score = 0.5 if result == DRAW else 1.0
+    return k * (score - expectedScore(winnerRating, loserRating))
+
+
+def batchRatings(initial, matches, k=ELO_K):
+    """Recomputes ratings from the matches of a whole season.
+
+    Gives the same ratings as applying eloChange match by match. With NumPy
+    installed the matches are cut into runs in which no player plays twice,
+    such as the rounds of a Swiss tournament, and every run is rated with
+    one vectorized update. Without NumPy they are rated one by one.
+
+    Args:
+      initial: dict mapping every player id to its rating before the season
+      matches: list of (winner, loser, result) tuples in the order they were
+        reported
+      k: most points a match moves a rating by
+
+    Returns:
+      A tuple (ratings, changes)
+        ratings: dict mapping every player id to its rating after the season
+        changes: list of the eloChange of every match, in order
+    """
+    if numpy is None or not matches:
+        return _sequentialRatings(initial, matches, k)
+    players = list(initial)
+    ids = numpy.array(players)
+    # Maps a player id, less the lowest one, to its position
+    lowest = ids.min()
+    positions = numpy.zeros(ids.max() - lowest + 1, dtype=int)
+    positions[ids - lowest] = numpy.arange(len(ids))
+    ratings = numpy.array([initial[player] for player in players],
+                          dtype=float)
+    changes = numpy.zeros(len(matches))
+    # Convert the matches to columns, the missing loser of a bye to nan
+    winners, losers, results = zip(*matches)
+    results = numpy.array(results)
+    indices = numpy.flatnonzero(results != BYE)
+    winners = positions[numpy.array(winners)[indices] - lowest]
+    losers = positions[numpy.array(losers, dtype=float)[indices].astype(
+        ids.dtype) - lowest]
+    scores = numpy.where(results[indices] == DRAW, 0.5, 1.0)
+    previous = _previousMatch(winners, losers)
+    start = 0
+    while start < len(indices):
+        end = _runEnd(previous, start)
+        run = slice(start, end)
+        expected = 1 / (1 + 10 ** ((ratings[losers[run]] -
+                                    ratings[winners[run]]) / ELO_SCALE))
+        change = k * (scores[run] - expected)
+        ratings[winners[run]] += change
+        ratings[losers[run]] -= change
+        changes[indices[run]] = change
+        start = end
+    return dict(zip(players, ratings.tolist())), changes.tolist()
+
+
+def _previousMatch(winners, losers):
+    """Returns the index of the last earlier match of either player of every
+    match, -1 for a match whose players did not play before."""
+    count = len(winners)
+    if not count:
+        return numpy.zeros(0, dtype=int)
+    players = numpy.concatenate((winners, losers))
+    matches = numpy.concatenate((numpy.arange(count), numpy.arange(count)))
+    # Sort appearances by player and match, each follows the one before it
+    order = numpy.argsort(players * count + matches)
+    previous = numpy.empty(2 * count, dtype=int)
+    previous[order[0]] = -1
+    previous[order[1:]] = numpy.where(
+        players[order[1:]] == players[order[:-1]], matches[order[:-1]], -1)
+    return numpy.maximum(previous[:count], previous[count:])
+
+
+def _runEnd(previous, start):
+    """Returns the end of the run of matches from start in which no player
+    plays twice, searching in growing windows."""
+    window = 64
+    while start + 1 < len(previous):
+        stop = min(len(previous), start + 1 + window)
+        repeats = numpy.flatnonzero(previous[start + 1:stop] >= start)
+        if len(repeats):
+            return start + 1 + repeats[0]
+        if stop == len(previous):
+            break
+        window *= 4
+    return len(previous)
+
+
+def _sequentialRatings(initial, matches, k):
+    """batchRatings without NumPy, one match at a time."""
+    ratings = dict(initial)
+    changes = []
+    for winner, loser, result in matches:
+        change = 0.0
+        if result != BYE:
+            change = eloChange(ratings[winner], ratings[loser], result, k)
+            ratings[winner] += change
+            ratings[loser] -= change
+        changes.append(change)
+    return ratings, changes
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# scoring.py -- match results, their validation and the points they are worth
+#
+
+# Results of a match
+WIN = 'win'
+DRAW = 'draw'
+BYE = 'bye'
+RESULTS = (WIN, DRAW, BYE)
+
+# Match points of (winner, loser) for every result, the same points the
+# Standing triggers and Standings_View in tournament.sql award
+MATCH_POINTS = {WIN: (3, 0), DRAW: (1, 1), BYE: (3, 0)}
+
+# Game score of (winner, loser) for every result, the chess style score
+# Buchholz and Sonneborn-Berger tiebreaks add up
+GAME_SCORE = {WIN: (1, 0), DRAW: (0.5, 0.5), BYE: (1, 0)}
+
+
+def matchRow(winner, loser, result=WIN, games=None):
+    """Returns the Match columns of a valid match or raises ValueError.
+
+    Returns:
+      A tuple (winner, loser, result, winner_games, loser_games).
+    """
+    if result not in RESULTS:
+        raise ValueError('result must be one of %s, got %r' % (
+            ', '.join(RESULTS), result))
+    winner = playerId(winner)
+    if result == BYE:
+        if loser is not None:
+            raise ValueError('a bye has no opponent, got %r' % (loser,))
+    else:
+        loser = playerId(loser)
+        if winner == loser:
+            raise ValueError('player %d cannot play against itself' % winner)
+    if games is None:
+        winnerGames = loserGames = None
+    else:
+        winnerGames, loserGames = [_gameCount(count) for count in games]
+    return (winner, loser, result, winnerGames, loserGames)
+
+
+def playerId(value):
+    """Returns value as an integer player id or raises ValueError."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('player id must be an integer, got %r' % (value,))
+
+
+def _gameCount(value):
+    """Returns value as a non negative number of games or raises ValueError."""
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        count = -1
+    if count < 0:
+        raise ValueError('games won must be a non negative integer, got %r'
+                         % (value,))
+    return count
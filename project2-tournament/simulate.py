@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# simulate.py -- Monte Carlo simulation of full Swiss tournaments
+#
+# Usage:
+#   python simulate.py [tournaments] [players] [rounds]
+#
+# Plays every tournament on the in-memory backend with random results and
+# reports how many tournaments per second were simulated.
+#
+
+import math
+import random
+import sys
+import time
+
+from memory_backend import MemoryBackend
+from scoring import BYE
+
+
+def playTournament(backend, players, rounds):
+    """Play a whole Swiss tournament with random results.
+
+    Returns:
+      The final standings of the tournament.
+    """
+    tournament = backend.createTournament('Simulation')
+    backend.registerPlayers(['Player %d' % i for i in range(players)],
+                            tournament)
+    for _ in range(rounds):
+        pairings = backend.swissPairings(tournament)
+        backend.reportMatches(
+            [(id1, None, BYE) if id2 is None
+             else random.choice([(id1, id2), (id2, id1)])
+             for (id1, name1, id2, name2) in pairings], tournament)
+    standings = backend.playerStandings(tournament)
+    backend.deleteTournament(tournament)
+    return standings
+
+
+def simulate(tournaments, players, rounds=None):
+    """Play tournaments and print how many were simulated per second."""
+    if rounds is None:
+        # Enough Swiss rounds to find a single undefeated player
+        rounds = int(math.ceil(math.log(players, 2)))
+    backend = MemoryBackend()
+    start = time.time()
+    for _ in range(tournaments):
+        playTournament(backend, players, rounds)
+    elapsed = time.time() - start
+    print '%d tournaments of %d players and %d rounds in %.3f s' % (
+        tournaments, players, rounds, elapsed)
+    print '%.1f tournaments per second' % (tournaments / elapsed)
+
+
+if __name__ == '__main__':
+    tournaments = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    simulate(tournaments, players, rounds)
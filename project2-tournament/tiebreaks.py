@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- tiebreak scores computed from a single match fetch
+#
+
+from scoring import BYE, DRAW, GAME_SCORE, MATCH_POINTS
+
+# Names of the tiebreaks, in the order they are appended to standings
+TIEBREAKS = ('omw', 'buchholz', 'sonnebornBerger')
+# Lowest match win percentage counted for an opponent in OMW
+MIN_WIN_PERCENTAGE = 1.0 / 3
+
+
+def computeTiebreaks(players, matches):
+    """Computes every tiebreak for all players in two passes over matches.
+
+    The first pass sums each player's points, game score and match count,
+    the second adds the opponents' values up per player, so the cost is
+    O(matches) however many players there are.
+
+      omw: opponents' match win percentage, the average of every
+        opponent's match points / (3 * matches), each floored at
+        MIN_WIN_PERCENTAGE
+      buchholz: the sum of every opponent's game score (1 for a win, 1/2
+        for a draw)
+      sonnebornBerger: the sum of the game scores of every opponent beaten
+        plus half the game scores of every opponent drawn
+
+    Byes count for the player's own record but add no opponent.
+
+    Args:
+      players: ids of every player in the tournament
+      matches: list of (winner, loser, result) tuples, see scoring.RESULTS
+
+    Returns:
+      A dict mapping every player id to a tuple (omw, buchholz,
+      sonnebornBerger).
+    """
+    return _tally(players, matches)[1]
+
+
+def rankStandings(standings, matches, order):
+    """Appends the tiebreak columns to standings rows and ranks them.
+
+    Rows are ranked by match points first and then by the tiebreaks named
+    in order, all descending.
+
+    Args:
+      standings: list of (id, name, wins, matches) tuples
+      matches: list of (winner, loser, result) tuples
+      order: sequence of names from TIEBREAKS ranking players tied on points
+
+    Returns:
+      A list of (id, name, wins, matches, omw, buchholz, sonnebornBerger)
+      tuples.
+    """
+    for name in order:
+        if name not in TIEBREAKS:
+            raise ValueError('unknown tiebreak %r, expected one of %s' % (
+                name, ', '.join(TIEBREAKS)))
+    points, scores = _tally([row[0] for row in standings], matches)
+    columns = [TIEBREAKS.index(name) for name in order]
+    ranked = [tuple(row) + scores[row[0]] for row in standings]
+    ranked.sort(key=lambda row: tuple(
+        [-points[row[0]]] + [-scores[row[0]][column] for column in columns]))
+    return ranked
+
+
+def _tally(players, matches):
+    """Returns (points, tiebreaks) dicts, see computeTiebreaks."""
+    points = dict.fromkeys(players, 0)
+    score = dict.fromkeys(players, 0)
+    played = dict.fromkeys(players, 0)
+    for winner, loser, result in matches:
+        winnerPoints, loserPoints = MATCH_POINTS[result]
+        winnerScore, loserScore = GAME_SCORE[result]
+        points[winner] += winnerPoints
+        score[winner] += winnerScore
+        played[winner] += 1
+        if result != BYE:
+            points[loser] += loserPoints
+            score[loser] += loserScore
+            played[loser] += 1
+    winPercentage = dict(
+        (player, max(MIN_WIN_PERCENTAGE, points[player] / (3.0 * count))
+         if count else MIN_WIN_PERCENTAGE)
+        for player, count in played.items())
+    omw = dict.fromkeys(players, 0.0)
+    opponents = dict.fromkeys(players, 0)
+    buchholz = dict.fromkeys(players, 0)
+    sonnebornBerger = dict.fromkeys(players, 0)
+    for winner, loser, result in matches:
+        if result == BYE:
+            continue
+        opponents[winner] += 1
+        opponents[loser] += 1
+        omw[winner] += winPercentage[loser]
+        omw[loser] += winPercentage[winner]
+        buchholz[winner] += score[loser]
+        buchholz[loser] += score[winner]
+        if result == DRAW:
+            sonnebornBerger[winner] += score[loser] / 2.0
+            sonnebornBerger[loser] += score[winner] / 2.0
+        else:
+            sonnebornBerger[winner] += score[loser]
+    tiebreaks = dict(
+        (player, (omw[player] / opponents[player] if opponents[player]
+                  else 0.0,
+                  buchholz[player], sonnebornBerger[player]))
+        for player in players)
+    return points, tiebreaks
@@ -3,40 +3,394 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import itertools
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 import bleach
-import sys
+
+import brackets
+import event_log
+import instrumentation
+import pairing
+import ratings as rating
+import tiebreaks as tiebreak
+from scoring import WIN, DRAW, BYE, matchRow
+
+# Connection string of the tournament database
+DSN = os.environ.get('TOURNAMENT_DSN', 'dbname=tournament')
+# Number of connections opened up front and kept open by the pool
+POOL_MIN_CONNECTIONS = int(os.environ.get('TOURNAMENT_POOL_MIN', 1))
+# Upper bound of connections the pool will ever open at once
+POOL_MAX_CONNECTIONS = int(os.environ.get('TOURNAMENT_POOL_MAX', 10))
+# Idle seconds after which a connection is pinged before it is reused
+POOL_HEALTH_CHECK_INTERVAL = 30
+# Tournament created by tournament.sql, used when no tournament is given
+DEFAULT_TOURNAMENT = 1
+# Logged events after which reportMatches snapshots the standings
+SNAPSHOT_INTERVAL = 1000
+# Statements slower than this many milliseconds are logged to stderr
+SLOW_QUERY_MS = os.environ.get('TOURNAMENT_SLOW_QUERY_MS')
+# Rows fetched per round trip by streamStandings
+STREAM_BATCH_SIZE = 1000
+
+# Select standings from the trigger maintained Standing table
+STANDINGS_QUERY = """SELECT p.id, p.name, s.won, s.played
+                     FROM Standing AS s JOIN Player AS p ON p.id = s.player_id
+                     WHERE s.tournament_id = %s
+                     ORDER BY s.points DESC, s.won DESC;"""
+
+# Hot statements prepared once per pooled connection, see executePrepared,
+# as {name: (parameter types, statement)}
+PREPARED_STATEMENTS = {
+    'count_players': (
+        ('integer',),
+        "SELECT count(*) FROM Player WHERE tournament_id = $1"),
+    'register_player': (
+        ('text', 'integer', 'double precision'),
+        """INSERT INTO Player (name, tournament_id, rating, initial_rating)
+           VALUES ($1, $2, $3, $3)"""),
+    'standings_version': (
+        ('integer',),
+        "SELECT standings_version FROM Tournament WHERE id = $1"),
+    'player_standings': (
+        ('integer',),
+        """SELECT p.id, p.name, s.won, s.played
+           FROM Standing AS s JOIN Player AS p ON p.id = s.player_id
+           WHERE s.tournament_id = $1
+           ORDER BY s.points DESC, s.won DESC"""),
+    'report_match': (
+        ('integer', 'integer', 'text', 'integer', 'integer', 'integer'),
+        """INSERT INTO Match (winner, loser, result, winner_games,
+                              loser_games, tournament_id)
+           VALUES ($1, $2, $3, $4, $5, $6) RETURNING id"""),
+}
+
+
+# Storage backend set with setBackend, None runs on PostgreSQL
+_backend = None
+# Name of the tournament function running in each thread, for the hooks
+_calls = threading.local()
+# Numbers the server-side cursors of streamQuery
+_cursorIds = itertools.count(1)
+
+if SLOW_QUERY_MS:
+    instrumentation.addHook(
+        instrumentation.SlowQueryLog(float(SLOW_QUERY_MS) / 1000))
+
+
+class TournamentError(Exception):
+    """Base class of the errors raised by the tournament API."""
+
+
+class DatabaseUnavailable(TournamentError):
+    """No connection to the tournament database could be checked out."""
+
+
+class QueryError(TournamentError):
+    """A statement failed in the database and was rolled back.
+
+    Attributes:
+      query: the statement that failed
+      pgcode: the PostgreSQL error code, e.g. '23503' for a foreign key
+        violation
+    """
+
+    def __init__(self, message, query=None, pgcode=None):
+        TournamentError.__init__(self, message)
+        self.query = query
+        self.pgcode = pgcode
+
+
+def setBackend(backend):
+    """Runs the tournament API on backend instead of PostgreSQL.
+
+    Args:
+      backend: an object implementing every tournament function as a method
+        with the same signature, e.g. memory_backend.MemoryBackend(). None
+        switches back to PostgreSQL.
+    """
+    global _backend
+    _backend = backend
+
+
+def pluggable(function):
+    """Hands calls of function to the backend set with setBackend."""
+    @wraps(function)
+    def dispatch(*args, **kwargs):
+        if _backend is not None:
+            return getattr(_backend, function.__name__)(*args, **kwargs)
+        # Remember the innermost running function for the query hooks
+        caller = getattr(_calls, 'function', None)
+        _calls.function = function.__name__
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _calls.function = caller
+    return dispatch
 
 
 def connect():
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    return psycopg2.connect(DSN)
+
 
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection remembering the names of the statements prepared on it."""
 
-def deleteMatches():
-    """Remove all the match records from the database."""
-    query = "delete from match;"
-    # Execute delete match query and do not fetch results
-    executeQuery(query, None, False)
+    def __init__(self, *args, **kwargs):
+        psycopg2.extensions.connection.__init__(self, *args, **kwargs)
+        self.prepared = set()
 
 
-def deletePlayers():
-    """Remove all the player records from the database."""
-    query = "delete from Player;"
+class ConnectionPool(object):
+    """Thread safe pool of reusable database connections.
+
+    Connections are checked out with the connection() context manager,
+    which blocks while all maxconn connections are in use, commits on a
+    clean exit and rolls back on error before handing the connection back.
+
+    Args:
+      dsn: connection string passed to psycopg2.connect
+      minconn: number of connections opened up front
+      maxconn: maximum number of connections open at the same time
+      healthCheckInterval: idle seconds before a connection is pinged
+    """
+
+    def __init__(self, dsn, minconn, maxconn,
+                 healthCheckInterval=POOL_HEALTH_CHECK_INTERVAL):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, dsn, connection_factory=PreparingConnection)
+        # Bounds concurrent checkouts so callers wait instead of failing
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lastUsed = {}
+        self.healthCheckInterval = healthCheckInterval
+
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection for the duration of a with block."""
+        self._slots.acquire()
+        try:
+            connection = self._checkout()
+            try:
+                yield connection
+                connection.commit()
+            except BaseException:
+                errorType, error, trace = sys.exc_info()
+                if not connection.closed:
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        # Closed so the pool discards it instead of handing
+                        # out a connection stuck in the failed transaction
+                        connection.close()
+                # The original error, not one of the failed rollback
+                raise errorType, error, trace
+            finally:
+                self._checkin(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close every connection held by the pool."""
+        self._pool.closeall()
+        self._lastUsed.clear()
+
+    def _checkout(self):
+        # Discard broken connections until a healthy one comes back
+        while True:
+            connection = self._pool.getconn()
+            if self._isHealthy(connection):
+                return connection
+            self._pool.putconn(connection, close=True)
+            self._lastUsed.pop(id(connection), None)
+
+    def _checkin(self, connection):
+        broken = bool(connection.closed)
+        if broken:
+            self._lastUsed.pop(id(connection), None)
+        else:
+            self._lastUsed[id(connection)] = time.time()
+        self._pool.putconn(connection, close=broken)
+
+    def _isHealthy(self, connection):
+        """Returns False for closed connections or ones failing a ping."""
+        if connection.closed:
+            return False
+        lastUsed = self._lastUsed.get(id(connection))
+        # Only ping connections that have been idle for a while
+        if lastUsed is None or \
+                time.time() - lastUsed < self.healthCheckInterval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool = None
+_poolLock = threading.Lock()
+# Pools a forked child inherited from its parent, never closed, see
+# resetPool
+_inheritedPools = []
+
+
+def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _poolLock:
+            if _pool is None:
+                _pool = ConnectionPool(DSN, POOL_MIN_CONNECTIONS,
+                                       POOL_MAX_CONNECTIONS)
+    return _pool
+
+
+def closePool():
+    """Close the shared connection pool, a new one is opened on next use."""
+    global _pool
+    with _poolLock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def resetPool():
+    """Forget the shared pool without closing its connections.
+
+    For forked child processes: the connections belong to the parent, the
+    child opens a pool of its own on next use. The inherited pool stays
+    referenced for the life of the process, freeing its connections would
+    end the parent's sessions on the shared sockets.
+    """
+    global _pool, _poolLock
+    if _pool is not None:
+        _inheritedPools.append(_pool)
+    _pool = None
+    _poolLock = threading.Lock()
+
+
+# Standings rows read by playerStandings as {tournament: (standings_version,
+# rows)}
+_standingsCache = {}
+_standingsCounters = {'hits': 0, 'misses': 0}
+_standingsLock = threading.Lock()
+
+
+def invalidateStandings(tournament=None):
+    """Drops the cached standings of a tournament, or of all for None.
+
+    Changes to players and matches bump the tournament's standings_version
+    in the database, which cachedStandings checks on every read, so only
+    changes made around the triggers in tournament.sql need this.
+    """
+    with _standingsLock:
+        if tournament is None:
+            _standingsCache.clear()
+        else:
+            _standingsCache.pop(tournament, None)
+
+
+def standingsCacheStats():
+    """Returns the hits, misses and size of the standings cache as a dict."""
+    with _standingsLock:
+        stats = dict(_standingsCounters)
+        stats['size'] = len(_standingsCache)
+    return stats
+
+
+def cachedStandings(tournament):
+    """Returns the rows of STANDINGS_QUERY, from the cache when current.
+
+    The cached rows are current while the tournament's standings_version
+    is still the one read before them. Checking it is a single primary key
+    lookup, so changes made by other processes are seen on the next read.
+    """
+    versions = executePrepared('standings_version', (tournament,), True)
+    version = versions[0][0] if versions else None
+    with _standingsLock:
+        cached = _standingsCache.get(tournament)
+        if cached is not None and cached[0] == version:
+            _standingsCounters['hits'] += 1
+            return list(cached[1])
+        _standingsCounters['misses'] += 1
+    # Changes committed after the version was read are cached under the
+    # older version, so the next read misses and picks them up
+    results = executePrepared('player_standings', (tournament,), True)
+    with _standingsLock:
+        _standingsCache[tournament] = (version, results)
+    return list(results)
+
+
+@pluggable
+def createTournament(name):
+    """Creates a new tournament with its own match storage.
+
+    Args:
+      name: the tournament's name
+
+    Returns:
+      The id of the new tournament, to pass to every other function.
+    """
+    query = "SELECT create_tournament(%s);"
+    results = executeQuery(query, (bleach.clean(name, strip=True),), True)
+    return results[0][0]
+
+
+@pluggable
+def deleteTournament(tournament):
+    """Removes a tournament with all of its players and matches.
+
+    The tournament's match partition is dropped as a whole instead of
+    deleting its matches row by row.
+    """
+    query = "SELECT drop_tournament(%s);"
+    executeQuery(query, (tournament,), False)
+    invalidateStandings(tournament)
+
+
+@pluggable
+def deleteMatches(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the match records of a tournament from the database."""
+    query = "SELECT clear_matches(%s);"
+    # Truncate the tournament's match partition and reset its standings
+    executeQuery(query, (tournament,), False)
+    invalidateStandings(tournament)
+
+
+@pluggable
+def deletePlayers(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the player records of a tournament from the database."""
+    query = "delete from Player where tournament_id = %s;"
     # Execute delete Player query and do not fetch results
-    executeQuery(query, None, False)
+    executeQuery(query, (tournament,), False)
+    invalidateStandings(tournament)
 
 
-def countPlayers():
+@pluggable
+def countPlayers(tournament=DEFAULT_TOURNAMENT):
     """Returns the number of players currently registered."""
-    query = "select count(*) from Player limit 1;"
-    # Execute select query and fetch results
-    results = executeQuery(query, None, True)
+    # Execute the prepared select and fetch results
+    results = executePrepared('count_players', (tournament,), True)
     count = results[0][0]
     return count
 
 
-def registerPlayer(name):
+@pluggable
+def registerPlayer(name, tournament=DEFAULT_TOURNAMENT,
+                   initialRating=rating.INITIAL_RATING):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -44,94 +398,638 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+      tournament: the id of the tournament the player registers for
+      initialRating: the player's Elo rating, e.g. from a previous season
     """
     # Sanitize  passed in name field
     bleached_name = bleach.clean(name, strip=True)
-    query = "insert into player (name) values (%s)"
-    # Execute insert query and do not fetch results
-    executeQuery(query, (bleached_name,), False)
+    # Execute the prepared insert and do not fetch results
+    executePrepared('register_player',
+                    (bleached_name, tournament, initialRating), False)
+    invalidateStandings(tournament)
+
+
+@pluggable
+def registerPlayers(names, tournament=DEFAULT_TOURNAMENT,
+                    initialRatings=None):
+    """Adds many players to the tournament database in one transaction.
+
+    Args:
+      names: iterable of the players' full names (need not be unique).
+      tournament: the id of the tournament the players register for
+      initialRatings: optional list of the players' Elo ratings, in the
+        order of names
+
+    Raises:
+      ValueError: if initialRatings does not hold one rating per name
+    """
+    names = list(names)
+    ratings = rating.startingRatings(len(names), initialRatings)
+    # Sanitize every passed in name field
+    rows = [(bleach.clean(name, strip=True), tournament, playerRating,
+             playerRating) for name, playerRating in zip(names, ratings)]
+    query = """insert into player (name, tournament_id, rating,
+                                   initial_rating) values %s"""
+    # Execute one multi-row insert for all players
+    executeValues(query, rows)
+    invalidateStandings(tournament)
 
 
-def playerStandings():
-    """Returns a list of the players and their win records, sorted by wins.
+@pluggable
+def playerStandings(tournament=DEFAULT_TOURNAMENT, tiebreaks=None):
+    """Returns a list of the players and their win records, sorted by points.
 
     The first entry in the list should be the player in first place,
-    or a player tied for first place if there is currently a tie.
+    or a player tied for first place if there is currently a tie.  Players
+    are ranked by match points (see scoring.MATCH_POINTS) and then by wins.
+
+    Args:
+      tournament: the id of the tournament
+      tiebreaks: optional sequence of tiebreak names (see
+        tiebreaks.TIEBREAKS) ranking players tied on points, in order. When
+        given, every row also carries all tiebreak columns.
 
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
         name: the player's full name (as registered)
-        wins: the number of matches the player has won
+        wins: the number of matches the player has won, byes included
         matches: the number of matches the player has played
+      With tiebreaks the tuples contain (id, name, wins, matches, omw,
+      buchholz, sonnebornBerger), see tiebreaks.computeTiebreaks.
+    """
+    # Read the standings through the cache, see invalidateStandings
+    results = cachedStandings(tournament)
+    if tiebreaks is None:
+        # return player standings.
+        return results
+    # Compute every tiebreak from a single fetch of the matches
+    return tiebreak.rankStandings(results, matchHistory(tournament),
+                                  tiebreaks)
+
+
+@pluggable
+def streamStandings(tournament=DEFAULT_TOURNAMENT,
+                    batchSize=STREAM_BATCH_SIZE):
+    """Yields the standings in batches, for events too large to list.
+
+    Reads the same rows in the same order as playerStandings through a
+    server-side cursor, bypassing the standings cache, so memory use does
+    not grow with the number of players. See tournament_export.py.
+
+    Args:
+      tournament: the id of the tournament
+      batchSize: rows fetched from the database per batch
+
+    Returns:
+      An iterator of lists of at most batchSize (id, name, wins, matches)
+      tuples.
+    """
+    return streamQuery(STANDINGS_QUERY, (tournament,), batchSize)
+
+
+@pluggable
+def checkStandings(tournament=DEFAULT_TOURNAMENT):
+    """Compares the Standing table against the Standings_View aggregation.
+
+    Returns:
+      A list of tuples for every player whose stored standing differs from
+      the one aggregated from the Match table, each of which contains
+      (id, stored_wins, stored_matches, stored_draws, stored_points, wins,
+      matches, draws, points). Stored values are None for players missing
+      from the Standing table. An empty list means the table is consistent.
     """
-    query = "SELECT * FROM Standings_View;"
-    # Execute select query and fetch results.
-    results = executeQuery(query, None, True)
-    # return player standings.
-    return results
+    query = """SELECT v.id, s.won, s.played, s.drawn, s.points,
+                      v.won, v.played, v.drawn, v.points
+               FROM Standings_View AS v
+               LEFT JOIN Standing AS s ON s.player_id = v.id
+               WHERE v.tournament_id = %s
+                 AND (s.player_id IS NULL
+                      OR (s.won, s.played, s.drawn, s.points)
+                         <> (v.won, v.played, v.drawn, v.points));"""
+    return executeQuery(query, (tournament,), True)
+
 
+@pluggable
+def rebuildStandings(tournament=DEFAULT_TOURNAMENT):
+    """Recomputes a tournament's standings from its matches."""
+    query = """DELETE FROM Standing WHERE tournament_id = %(tournament)s;
+               SELECT bump_standings_version(%(tournament)s);
+               INSERT INTO Standing (player_id, tournament_id, won, played,
+                                     drawn, points)
+               SELECT id, tournament_id, won, played, drawn, points
+               FROM Standings_View
+               WHERE tournament_id = %(tournament)s;"""
+    executeQuery(query, {'tournament': tournament}, False)
+    invalidateStandings(tournament)
 
-def reportMatch(winner, loser):
+
+@pluggable
+def reportMatch(winner, loser, tournament=DEFAULT_TOURNAMENT, result=WIN,
+                games=None):
     """Records the outcome of a single match between two players.
 
+    Afterwards the standings are snapshotted once SNAPSHOT_INTERVAL events
+    have been logged since the last snapshot.
+
     Args:
       winner:  the id number of the player who won
-      loser:  the id number of the player who lost
+      loser:  the id number of the player who lost, None for a bye
+      tournament: the id of the tournament both players registered for
+      result: WIN, DRAW (winner and loser are the two players) or BYE
+      games: optional (winner_games, loser_games) score of a multi-game match
+
+    Returns:
+      The id of the recorded match, see voidMatch.
     """
-    # Sanitize  passed in winner and loser field
-    winner = bleach.clean(winner, strip=True)
-    loser = bleach.clean(loser, strip=True)
-    query = "INSERT INTO Match (winner, loser) VALUES (%s, %s)"
-    # Execute insert query and do not fetch results
-    executeQuery(query, (winner, loser,), False)
+    # Validate passed in winner and loser ids and the result
+    row = matchRow(winner, loser, result, games) + (tournament,)
+    # Execute the prepared insert and fetch the new match id
+    results = executePrepared('report_match', row, True)
+    invalidateStandings(tournament)
+    snapshotStandings(tournament, SNAPSHOT_INTERVAL)
+    return results[0][0] if results else None
+
+
+@pluggable
+def reportMatches(results, tournament=DEFAULT_TOURNAMENT):
+    """Records the outcomes of a whole round of matches at once.
 
+    All matches are validated first and then inserted with a single
+    multi-row insert, so either the whole round is recorded or none of it.
+    Afterwards the standings are snapshotted once SNAPSHOT_INTERVAL events
+    have been logged since the last snapshot.
 
-def swissPairings():
+    Args:
+      results: iterable of (winner, loser) player id pairs, optionally
+        followed by the result and the games score as in reportMatch
+      tournament: the id of the tournament all players registered for
+
+    Returns:
+      The ids of the recorded matches, in the order they were given.
+    """
+    rows = [matchRow(*match) + (tournament,) for match in results]
+    query = """INSERT INTO Match (winner, loser, result, winner_games,
+                                  loser_games, tournament_id) VALUES %s
+               RETURNING id"""
+    # Execute one multi-row insert for the whole round
+    ids = [row[0] for row in executeValues(query, rows, True)]
+    invalidateStandings(tournament)
+    snapshotStandings(tournament, SNAPSHOT_INTERVAL)
+    return ids
+
+
+@pluggable
+def voidMatch(match, tournament=DEFAULT_TOURNAMENT):
+    """Removes a recorded match, its players' standings are corrected.
+
+    Args:
+      match: the id of the match, as returned by reportMatch
+      tournament: the id of the tournament the match was reported for
+    """
+    query = "DELETE FROM Match WHERE tournament_id = %s AND id = %s;"
+    executeQuery(query, (tournament, match), False)
+    invalidateStandings(tournament)
+    snapshotStandings(tournament, SNAPSHOT_INTERVAL)
+
+
+@pluggable
+def lastEvent(tournament=DEFAULT_TOURNAMENT):
+    """Returns the id of the latest event logged for a tournament."""
+    query = "SELECT max(id) FROM Tournament_Event WHERE tournament_id = %s;"
+    results = executeQuery(query, (tournament,), True)
+    return results[0][0] if results else None
+
+
+@pluggable
+def snapshotStandings(tournament=DEFAULT_TOURNAMENT, minEvents=1):
+    """Stores the current standings as of the latest logged event.
+
+    Event ids are drawn when an event is logged, not when it commits. A
+    snapshot therefore first waits for every transaction logging events of
+    the tournament to end and holds off new ones, see lock_events_shared in
+    tournament.sql. No event below the snapshot's can commit after it. The
+    events are counted before that, so calls finding fewer than minEvents
+    return without blocking anyone.
+
+    Args:
+      tournament: the id of the tournament
+      minEvents: only snapshot when at least this many events were logged
+        since the previous snapshot
+    """
+    query = """INSERT INTO Standings_Snapshot (tournament_id, event_id,
+                                               standings)
+               SELECT %(tournament)s, e.last, coalesce(
+                   (SELECT json_agg(json_build_array(p.id, p.name, s.won,
+                                                     s.played, s.drawn,
+                                                     s.points))
+                    FROM Standing AS s JOIN Player AS p
+                    ON p.id = s.player_id
+                    WHERE s.tournament_id = %(tournament)s), '[]'::json)
+               FROM (SELECT max(id) AS last FROM Tournament_Event
+                     WHERE tournament_id = %(tournament)s) AS e
+               WHERE e.last IS NOT NULL AND
+                   (SELECT count(*) FROM Tournament_Event
+                    WHERE tournament_id = %(tournament)s
+                      AND id > coalesce(
+                          (SELECT max(event_id) FROM Standings_Snapshot
+                           WHERE tournament_id = %(tournament)s), 0))
+                   >= %(minEvents)s
+               ON CONFLICT DO NOTHING;"""
+    # Counts the events since the previous snapshot, up to minEvents
+    pending = """SELECT count(*) FROM (
+                     SELECT 1 FROM Tournament_Event
+                     WHERE tournament_id = %(tournament)s
+                       AND id > coalesce(
+                           (SELECT max(event_id) FROM Standings_Snapshot
+                            WHERE tournament_id = %(tournament)s), 0)
+                     LIMIT %(minEvents)s) AS e;"""
+    values = {'tournament': tournament, 'minEvents': max(minEvents, 1)}
+
+    def execute(cursor):
+        cursor.execute(pending, values)
+        if cursor.fetchone()[0] < values['minEvents']:
+            return []
+        # Runs before the insert takes its snapshot of the committed events,
+        # which checks the count again
+        cursor.execute("""SELECT pg_advisory_xact_lock(
+                              hashtext('Tournament_Event'), %s);""",
+                       (tournament,))
+        cursor.execute(query, values)
+        return []
+    runStatement(query, execute)
+
+
+@pluggable
+def standingsAt(tournament=DEFAULT_TOURNAMENT, event=None):
+    """Rebuilds the standings of a tournament as of a logged event.
+
+    Loads the latest snapshot taken at or before the event and replays
+    only the events logged after it (see event_log.replay).
+
+    Args:
+      tournament: the id of the tournament
+      event: the id of the last event to apply, see lastEvent. None
+        rebuilds the current standings.
+
+    Returns:
+      A list of (id, name, wins, matches) tuples ranked like
+      playerStandings.
+    """
+    params = {'tournament': tournament, 'event': event}
+    query = """SELECT event_id, standings FROM Standings_Snapshot
+               WHERE tournament_id = %(tournament)s
+                 AND (%(event)s IS NULL OR event_id <= %(event)s)
+               ORDER BY event_id DESC LIMIT 1;"""
+    snapshots = executeQuery(query, params, True)
+    since, snapshot = snapshots[0] if snapshots else (0, None)
+    params['since'] = since
+    query = """SELECT kind, player_id, name, winner, loser, result
+               FROM Tournament_Event
+               WHERE tournament_id = %(tournament)s AND id > %(since)s
+                 AND (%(event)s IS NULL OR id <= %(event)s)
+               ORDER BY id;"""
+    events = executeQuery(query, params, True)
+    return [row[:4] for row in event_log.replay(snapshot, events)]
+
+
+@pluggable
+def matchHistory(tournament=DEFAULT_TOURNAMENT):
+    """Returns a list of (winner, loser, result) tuples of every match."""
+    query = "SELECT winner, loser, result FROM Match WHERE tournament_id = %s;"
+    return executeQuery(query, (tournament,), True)
+
+
+@pluggable
+def opponentHistory(tournament=DEFAULT_TOURNAMENT):
+    """Returns a dict mapping every player id to the set of ids it played."""
+    # Load the whole history once into in-memory adjacency sets
+    return pairing.opponentSets(matchHistory(tournament))
+
+
+@pluggable
+def playerRatings(tournament=DEFAULT_TOURNAMENT):
+    """Returns a list of the players and their Elo ratings, highest first.
+
+    Ratings move with every reported or voided match, see ratings.eloChange.
+
+    Returns:
+      A list of tuples, each of which contains (id, name, rating).
+    """
+    query = """SELECT id, name, rating FROM Player WHERE tournament_id = %s
+               ORDER BY rating DESC, id;"""
+    return executeQuery(query, (tournament,), True)
+
+
+@pluggable
+def recomputeRatings(tournament=DEFAULT_TOURNAMENT):
+    """Recomputes every rating from the initial ratings and all matches.
+
+    Matches are replayed in the order they were reported with
+    ratings.batchRatings, e.g. after matches have been voided out of order.
+    """
+    query = """SELECT id, initial_rating FROM Player
+               WHERE tournament_id = %s;"""
+    initial = dict(executeQuery(query, (tournament,), True))
+    query = """SELECT id, winner, loser, result FROM Match
+               WHERE tournament_id = %s ORDER BY id;"""
+    matches = executeQuery(query, (tournament,), True)
+    ratings, changes = rating.batchRatings(
+        initial, [match[1:] for match in matches])
+    executeValues("""UPDATE Player SET rating = v.rating
+                     FROM (VALUES %s) AS v (id, rating)
+                     WHERE Player.id = v.id;""", ratings.items())
+    executeValues("""UPDATE Match SET rating_change = v.change
+                     FROM (VALUES %s) AS v (tournament_id, id, change)
+                     WHERE Match.tournament_id = v.tournament_id
+                       AND Match.id = v.id;""",
+                  [(tournament, match[0], change)
+                   for match, change in zip(matches, changes)])
+
+
+@pluggable
+def swissPairings(tournament=DEFAULT_TOURNAMENT, seedByRating=False):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Each player is paired
+    with the closest ranked player he or she has not played yet, so players
+    with an equal or nearly-equal win record meet and rematches are avoided
+    whenever possible (see pairing.pairPlayers).  With an odd number of
+    players the lowest ranked player without a bye so far gets a bye, which
+    is returned as the last pair with None in place of the opponent. Report
+    it with reportMatch(id, None, result=BYE).
+
+    Args:
+      tournament: the id of the tournament to pair
+      seedByRating: pair the first round by rating, the top half of the
+        players against the bottom half (see pairing.seededOrder)
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
-    """
-    # Get standings using player standings method
-    standings = playerStandings()
-    # Get count players using count players method
-    count = countPlayers()
-    # Empty list to populate pairnings list
-    pairings = []
-    for i in range(0, count, 2):
-        # Group ith element with i+1th element
-        group = zip(standings[i], standings[i+1])
-        # Append to pairning list in this format (id1, name1, id2, name2)
-        pairings.append([group[0][0], group[1][0], group[0][1], group[1][1]])
-    return pairings
+        id2: the second player's unique id, None for a bye
+        name2: the second player's name, None for a bye
+    """
+    history = matchHistory(tournament)
+    if seedByRating and not history:
+        standings = pairing.seededOrder(playerRatings(tournament))
+    else:
+        standings = playerStandings(tournament)
+    return pairing.pairStandings(standings, pairing.opponentSets(history),
+                                 pairing.byeSet(history))
+
+
+@pluggable
+def scheduleElimination(tournament=DEFAULT_TOURNAMENT, size=None):
+    """Schedules the first round of a single elimination bracket.
+
+    Players are seeded by their current standings, e.g. after the Swiss
+    rounds of the event, see brackets.seedBracket. Any earlier schedule of
+    the tournament is replaced. Report the matches with reportMatch and
+    schedule the next round with advanceElimination.
+
+    Args:
+      tournament: the id of the tournament
+      size: number of the top ranked players making the cut, all by default
+
+    Returns:
+      A list of (round, id1, id2) tuples, id2 is None for a bye.
+
+    Raises:
+      ValueError: if fewer than two players make the cut
+    """
+    players = [row[0] for row in playerStandings(tournament)][:size]
+    return storeSchedule(tournament, [brackets.seedBracket(players)])
+
+
+@pluggable
+def advanceElimination(tournament=DEFAULT_TOURNAMENT):
+    """Schedules the next elimination round from the winners of the last.
+
+    Returns:
+      A list of (round, id1, id2) tuples, empty once the final was played.
+
+    Raises:
+      ValueError: if no bracket was scheduled or a match of the last round
+        has no winner yet
+    """
+    query = """SELECT s.round, s.player1, s.player2, s.since_match
+               FROM Schedule AS s
+               WHERE s.tournament_id = %s AND s.round = (
+                   SELECT max(round) FROM Schedule WHERE tournament_id = %s)
+               ORDER BY s.slot;"""
+    last = executeQuery(query, (tournament, tournament), True)
+    if not last:
+        raise ValueError('no elimination bracket is scheduled for '
+                         'tournament %r' % (tournament,))
+    query = """SELECT winner, loser, result FROM Match
+               WHERE tournament_id = %s AND id > %s ORDER BY id;"""
+    matches = executeQuery(query, (tournament, last[0][3]), True)
+    pairs = brackets.nextRound([row[1:3] for row in last], matches)
+    if not pairs:
+        return []
+    return storeSchedule(tournament, [pairs], last[0][0] + 1)
+
+
+@pluggable
+def scheduleRoundRobin(tournament=DEFAULT_TOURNAMENT):
+    """Schedules every round of a round-robin between all players.
+
+    The whole schedule is generated in memory by the circle method (see
+    brackets.roundRobin) and stored with a single multi-row insert,
+    replacing any earlier schedule of the tournament.
+
+    Returns:
+      A list of (round, id1, id2) tuples, id2 is None for the player
+      sitting a round out.
+    """
+    players = sorted(row[0] for row in playerStandings(tournament))
+    return storeSchedule(tournament, brackets.roundRobin(players))
+
+
+@pluggable
+def scheduledPairings(tournament=DEFAULT_TOURNAMENT, round=None):
+    """Returns the scheduled (round, id1, id2) tuples, of one or all rounds.
+    """
+    query = """SELECT round, player1, player2 FROM Schedule
+               WHERE tournament_id = %s AND (%s IS NULL OR round = %s)
+               ORDER BY round, slot;"""
+    return executeQuery(query, (tournament, round, round), True)
+
+
+def storeSchedule(tournament, rounds, firstRound=1):
+    """Stores rounds of (id1, id2) pairs in the Schedule table.
+
+    Scheduling the first round replaces the tournament's earlier schedule,
+    all of it happens in one transaction.
+
+    Returns:
+      The stored schedule as a list of (round, id1, id2) tuples.
+    """
+    schedule = [(firstRound + number, id1, id2)
+                for number, pairs in enumerate(rounds)
+                for id1, id2 in pairs]
+    query = """INSERT INTO Schedule (tournament_id, round, slot, player1,
+                                     player2, since_match) VALUES %s"""
+
+    def execute(cursor):
+        if firstRound == 1:
+            cursor.execute("DELETE FROM Schedule WHERE tournament_id = %s;",
+                           (tournament,))
+        cursor.execute("""SELECT coalesce(max(id), 0) FROM Match
+                          WHERE tournament_id = %s;""", (tournament,))
+        since = cursor.fetchone()[0]
+        rows = [(tournament, round, slot, id1, id2, since)
+                for slot, (round, id1, id2) in enumerate(schedule)]
+        if rows:
+            psycopg2.extras.execute_values(cursor, query, rows,
+                                           page_size=len(rows))
+        return []
+    runStatement(query, execute)
+    return schedule
 
 
 # Execute the passed in query with values.
 def executeQuery(query, values, fetchResults):
-    """Execute the query"""
-    results = []
-    try:
-        connection = connect()
-        cursor = connection.cursor()
+    """Execute the query on a connection checked out from the shared pool"""
+    def execute(cursor):
         # Execute query with passed in values
         cursor.execute(query, values)
         # Fetch results only when fetchResults is True
         if fetchResults:
-            results = cursor.fetchall()
-    except:
-        print 'unexpected error occured', sys.exc_info()
+            return cursor.fetchall()
+        return []
+    return runStatement(query, execute)
+
+
+# Execute one of the PREPARED_STATEMENTS with values.
+def executePrepared(name, values, fetchResults):
+    """Execute a prepared statement, preparing it on first use per connection
+
+    Postgres parses and plans a prepared statement once per connection
+    instead of on every call.
+    """
+    types, query = PREPARED_STATEMENTS[name]
+
+    def execute(cursor):
+        prepared = cursor.connection.prepared
+        if name not in prepared:
+            cursor.execute('PREPARE %s (%s) AS %s' % (name, ', '.join(types),
+                                                      query))
+            # Prepared statements outlive the transaction, even a failed one
+            prepared.add(name)
+        cursor.execute('EXECUTE %s (%s)' % (name, ', '.join(
+            ['%s'] * len(values))), values)
+        if fetchResults:
+            return cursor.fetchall()
+        return []
+    return runStatement(query, execute)
+
+
+# Execute the passed in multi-row insert with all rows.
+def executeValues(query, rows, fetchResults=False):
+    """Execute the query once for all rows in a single transaction"""
+    if not rows:
+        return []
+
+    def execute(cursor):
+        # Expand the VALUES %s placeholder into one multi-row statement
+        return psycopg2.extras.execute_values(
+            cursor, query, rows, page_size=len(rows),
+            fetch=fetchResults) or []
+    return runStatement(query, execute)
+
+
+def runStatement(query, execute):
+    """Runs execute(cursor) on a pooled connection and returns its result.
+
+    The statement is committed on success and reported to the
+    instrumentation hooks either way.
+
+    Raises:
+      DatabaseUnavailable: if no connection could be checked out
+      QueryError: if the statement failed, it has been rolled back
+    """
+    function = getattr(_calls, 'function', None)
+    start = time.time()
+    acquired = None
+    rows = 0
+    error = None
+    try:
+        with getPool().connection() as connection:
+            acquired = time.time()
+            cursor = connection.cursor()
+            results = execute(cursor)
+            rows = len(results) if results else cursor.rowcount
+        return results
+    except psycopg2.Error, error:
+        raise queryError(error, query, acquired), None, sys.exc_info()[2]
+    except Exception, error:
+        # Still reported as a failure, e.g. a failing execute callback
+        raise
+    finally:
+        reportStatement(function, query, start, acquired, rows, error)
+
+
+def streamQuery(query, values, batchSize=STREAM_BATCH_SIZE):
+    """Runs a query on a server-side cursor and yields its rows in batches.
+
+    Only batchSize rows are held in memory at a time. The connection stays
+    checked out until the last batch has been read or the iteration is
+    abandoned, the statement is reported to the instrumentation hooks once
+    it is done.
+
+    Returns:
+      An iterator of lists of at most batchSize rows.
+    """
+    # Remember the calling function now, the rows are read after it returned
+    return _streamRows(getattr(_calls, 'function', None), query, values,
+                       batchSize)
+
+
+def _streamRows(function, query, values, batchSize):
+    """Generator behind streamQuery, reporting the query as function."""
+    start = time.time()
+    acquired = None
+    rows = 0
+    error = None
+    try:
+        with getPool().connection() as connection:
+            acquired = time.time()
+            cursor = connection.cursor(name='stream_%d' % next(_cursorIds))
+            cursor.execute(query, values)
+            while True:
+                batch = cursor.fetchmany(batchSize)
+                if not batch:
+                    break
+                rows += len(batch)
+                yield batch
+            cursor.close()
+    except psycopg2.Error, error:
+        raise queryError(error, query, acquired), None, sys.exc_info()[2]
+    except Exception, error:
+        # Still reported as a failure, e.g. an unavailable database
+        raise
     finally:
-        if connection:
-            connection.commit()
-            connection.close()
-    return results
+        reportStatement(function, query, start, acquired, rows, error)
+
+
+def queryError(error, query, acquired):
+    """Returns the TournamentError to raise for a psycopg2 error."""
+    message = str(error).strip()
+    if acquired is None:
+        return DatabaseUnavailable(
+            'cannot connect to the tournament database: ' + message)
+    return QueryError(message, query, error.pgcode)
+
+
+def reportStatement(function, query, start, acquired, rows, error):
+    """Hands a finished statement to the instrumentation hooks."""
+    if not instrumentation.hooks:
+        return
+    end = time.time()
+    instrumentation.notify(instrumentation.QueryEvent(
+        function, instrumentation.normalizeStatement(query),
+        end - acquired if acquired else 0.0, (acquired or end) - start, rows,
+        error))
@@ -1,4 +1,5 @@
 -- Table definitions for the tournament project.
+-- Requires PostgreSQL 11 or later for the partitioned Match table.
 
 -- Drop database tournament if exists.
 DROP DATABASE IF EXISTS tournament;
@@ -13,11 +14,17 @@ CREATE DATABASE tournament;
 -- Drop view standings if exists
 DROP VIEW IF EXISTS Standings_View CASCADE;
 
--- Drop view Winnings if exists
-DROP VIEW IF EXISTS Winning_View CASCADE;
+-- Drop Schedule table if exists.
+DROP TABLE IF EXISTS Schedule CASCADE;
 
--- Drop view losses if exists
-DROP VIEW IF EXISTS Matches_View CASCADE;
+-- Drop Standings_Snapshot table if exists.
+DROP TABLE IF EXISTS Standings_Snapshot CASCADE;
+
+-- Drop Tournament_Event table if exists.
+DROP TABLE IF EXISTS Tournament_Event CASCADE;
+
+-- Drop Standing table if exists.
+DROP TABLE IF EXISTS Standing CASCADE;
 
 -- Drop Match table if exists.
 DROP TABLE IF EXISTS Match CASCADE;
@@ -25,45 +32,374 @@ DROP TABLE IF EXISTS Match CASCADE;
 -- Drop Player table if exists.
 DROP TABLE IF EXISTS Player CASCADE;
 
--- Create table Player
-CREATE TABLE Player(
+-- Drop Tournament table if exists.
+DROP TABLE IF EXISTS Tournament CASCADE;
+
+-- Create table Tournament, standings_version counts the changes to its
+-- standings, see bump_standings_version
+CREATE TABLE Tournament(
   ID serial NOT NULL,
   Name text,
+  standings_version BIGINT NOT NULL DEFAULT 0,
   PRIMARY KEY (ID)
 );
 
--- Create table Match
+-- Create table Player, rating is the player's Elo rating kept up to date
+-- by the triggers below, initial_rating the one it registered with
+CREATE TABLE Player(
+  ID serial NOT NULL,
+  tournament_id INTEGER NOT NULL DEFAULT 1,
+  Name text,
+  rating double precision NOT NULL DEFAULT 1500,
+  initial_rating double precision NOT NULL DEFAULT 1500,
+  PRIMARY KEY (ID),
+  FOREIGN KEY (tournament_id) REFERENCES Tournament(ID) ON DELETE CASCADE
+);
+
+-- Index players by the tournament they registered for
+CREATE INDEX Player_Tournament_Idx ON Player (tournament_id);
+
+-- Create table Match, list partitioned with one partition per tournament
+-- (see create_tournament) so queries for one event never read another
+-- event's matches and dropping an event is a cheap partition drop.
+-- A draw stores both players as winner and loser, a bye has no loser.
+-- winner_games and loser_games hold the game score of multi-game matches,
+-- rating_change the Elo rating points the loser passed to the winner.
 CREATE TABLE Match(
   ID serial NOT NULL,
+  tournament_id INTEGER NOT NULL DEFAULT 1,
   loser INTEGER,
-  winner INTEGER,
-  PRIMARY KEY (ID),
+  winner INTEGER NOT NULL,
+  result text NOT NULL DEFAULT 'win',
+  winner_games INTEGER,
+  loser_games INTEGER,
+  rating_change double precision,
+  PRIMARY KEY (tournament_id, ID),
   FOREIGN KEY (loser) REFERENCES Player(ID),
-  FOREIGN KEY (winner) REFERENCES Player(ID)
+  FOREIGN KEY (winner) REFERENCES Player(ID),
+  CHECK (result IN ('win', 'draw', 'bye')),
+  CHECK ((result = 'bye') = (loser IS NULL))
+) PARTITION BY LIST (tournament_id);
+
+-- Index match participants for the per player lookups and aggregations
+CREATE INDEX Match_Winner_Idx ON Match (winner);
+CREATE INDEX Match_Loser_Idx ON Match (loser);
+
+-- Create table Schedule, the pairings of elimination and round-robin
+-- rounds before they are played. player2 is NULL for a bye, since_match
+-- the last match reported before the round was scheduled.
+CREATE TABLE Schedule(
+  tournament_id INTEGER NOT NULL,
+  round INTEGER NOT NULL,
+  slot INTEGER NOT NULL,
+  player1 INTEGER NOT NULL,
+  player2 INTEGER,
+  since_match INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (tournament_id, round, slot),
+  FOREIGN KEY (tournament_id) REFERENCES Tournament(ID) ON DELETE CASCADE,
+  FOREIGN KEY (player1) REFERENCES Player(ID) ON DELETE CASCADE,
+  FOREIGN KEY (player2) REFERENCES Player(ID) ON DELETE CASCADE
 );
 
--- Create the "Winning_View"
-CREATE VIEW Winning_View AS
-    SELECT p.id , count(m.winner) AS won
-    FROM player as p LEFT JOIN match as m
-    ON p.id = m.winner
-    GROUP BY p.id, m.winner
-    ORDER BY p.id;
-
--- Create the "Matches_View"
-CREATE VIEW Matches_View AS
-    SELECT p.id, count(m) AS played
-    FROM player as p LEFT JOIN match as m
-    ON(p.id = m.winner)
-    OR(p.id = m.loser)
-    GROUP BY p.id
-    ORDER BY p.id ASC;
-
---- Create the "Standings_View"
+--- Create the "Standings_View", aggregating every player's record and
+--- match points (3 for a win or a bye, 1 for a draw) in a single pass over
+--- one row per match participant
 CREATE VIEW Standings_View AS
-SELECT p.id, p.name, wv.won, mv.played
-	FROM player as p
-	LEFT JOIN Winning_view as wv ON p.id = wv.id
-	LEFT JOIN Matches_View as mv ON p.id = mv.id
-	GROUP BY p.id, p.name, wv.won, mv.played
-	ORDER BY wv.won DESC;
+SELECT p.id, p.tournament_id, p.name,
+       count(m.player) FILTER (WHERE m.outcome = 'won') AS won,
+       count(m.player) AS played,
+       count(m.player) FILTER (WHERE m.outcome = 'drawn') AS drawn,
+       coalesce(sum(m.points), 0)::integer AS points
+	FROM player as p LEFT JOIN (
+	    SELECT tournament_id, winner AS player,
+	           CASE result WHEN 'draw' THEN 'drawn' ELSE 'won' END AS outcome,
+	           CASE result WHEN 'draw' THEN 1 ELSE 3 END AS points
+	    FROM match
+	    UNION ALL
+	    SELECT tournament_id, loser AS player,
+	           CASE result WHEN 'draw' THEN 'drawn' ELSE 'lost' END AS outcome,
+	           CASE result WHEN 'draw' THEN 1 ELSE 0 END AS points
+	    FROM match WHERE loser IS NOT NULL) as m
+	ON p.id = m.player AND p.tournament_id = m.tournament_id
+	GROUP BY p.id, p.tournament_id, p.name
+	ORDER BY points DESC, won DESC;
+
+-- Create table Standing, kept up to date by the triggers below so reading
+-- standings never has to aggregate the Match table.
+CREATE TABLE Standing(
+  player_id INTEGER NOT NULL,
+  tournament_id INTEGER NOT NULL,
+  won INTEGER NOT NULL DEFAULT 0,
+  played INTEGER NOT NULL DEFAULT 0,
+  drawn INTEGER NOT NULL DEFAULT 0,
+  points INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (player_id),
+  FOREIGN KEY (player_id) REFERENCES Player(ID) ON DELETE CASCADE
+);
+
+-- Index standings of a tournament in the order they are read
+CREATE INDEX Standing_Points_Idx
+    ON Standing (tournament_id, points DESC, won DESC);
+
+-- Give every new player an empty standing
+CREATE OR REPLACE FUNCTION add_standing() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO Standing (player_id, tournament_id)
+        VALUES (NEW.id, NEW.tournament_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER Player_Standing_Trigger
+    AFTER INSERT ON Player
+    FOR EACH ROW EXECUTE PROCEDURE add_standing();
+
+-- Add (change 1) or remove (change -1) a match from both players'
+-- standings, with the same match points as Standings_View
+CREATE OR REPLACE FUNCTION apply_match(match_tournament integer,
+                                       match_winner integer,
+                                       match_loser integer,
+                                       match_result text,
+                                       change integer)
+RETURNS void AS $$
+DECLARE
+    updated integer;
+    loser_updated integer;
+    expected integer := 2;
+BEGIN
+    IF match_result = 'draw' THEN
+        UPDATE Standing SET drawn = drawn + change,
+                            played = played + change,
+                            points = points + change
+            WHERE player_id IN (match_winner, match_loser)
+              AND tournament_id = match_tournament;
+        GET DIAGNOSTICS updated = ROW_COUNT;
+    ELSE
+        UPDATE Standing SET won = won + change,
+                            played = played + change,
+                            points = points + 3 * change
+            WHERE player_id = match_winner
+              AND tournament_id = match_tournament;
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        IF match_loser IS NULL THEN
+            expected := 1;
+        ELSE
+            UPDATE Standing SET played = played + change
+                WHERE player_id = match_loser
+                  AND tournament_id = match_tournament;
+            GET DIAGNOSTICS loser_updated = ROW_COUNT;
+            updated := updated + loser_updated;
+        END IF;
+    END IF;
+    IF updated < expected THEN
+        RAISE EXCEPTION 'match players are not registered for tournament %',
+            match_tournament;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Apply every recorded or removed match to both players' standings
+CREATE OR REPLACE FUNCTION update_standing() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM apply_match(NEW.tournament_id, NEW.winner, NEW.loser,
+                            NEW.result, 1);
+        RETURN NEW;
+    END IF;
+    PERFORM apply_match(OLD.tournament_id, OLD.winner, OLD.loser,
+                        OLD.result, -1);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER Match_Standing_Trigger
+    AFTER INSERT OR DELETE ON Match
+    FOR EACH ROW EXECUTE PROCEDURE update_standing();
+
+-- Elo rating points the loser of a match passes to the winner, with the
+-- same K factor of 32 as ratings.ELO_K
+CREATE OR REPLACE FUNCTION elo_change(winner_rating double precision,
+                                      loser_rating double precision,
+                                      match_result text)
+RETURNS double precision AS $$
+    SELECT 32 * (CASE match_result WHEN 'draw' THEN 0.5 ELSE 1 END
+                 - 1 / (1 + 10 ^ ((loser_rating - winner_rating) / 400)));
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Move both players' ratings by every recorded match and back for every
+-- removed one, remembering the change on the match so it can be undone
+CREATE OR REPLACE FUNCTION update_rating() RETURNS trigger AS $$
+DECLARE
+    change double precision;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE Player SET rating = rating - CASE id
+                WHEN OLD.winner THEN OLD.rating_change
+                ELSE -OLD.rating_change END
+            WHERE id IN (OLD.winner, OLD.loser)
+              AND OLD.rating_change IS NOT NULL;
+        RETURN OLD;
+    END IF;
+    IF NEW.result = 'bye' THEN
+        RETURN NEW;
+    END IF;
+    SELECT elo_change(w.rating, l.rating, NEW.result) INTO change
+        FROM Player AS w, Player AS l
+        WHERE w.id = NEW.winner AND l.id = NEW.loser;
+    UPDATE Player SET rating = rating + CASE id
+            WHEN NEW.winner THEN change ELSE -change END
+        WHERE id IN (NEW.winner, NEW.loser);
+    UPDATE Match SET rating_change = change
+        WHERE tournament_id = NEW.tournament_id AND id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER Match_Rating_Trigger
+    AFTER INSERT OR DELETE ON Match
+    FOR EACH ROW EXECUTE PROCEDURE update_rating();
+
+-- Create table Tournament_Event, an append-only log of every change to a
+-- tournament's players and matches, written by the triggers below
+CREATE TABLE Tournament_Event(
+  ID bigserial NOT NULL,
+  tournament_id INTEGER NOT NULL,
+  kind text NOT NULL,
+  player_id INTEGER,
+  name text,
+  match_id INTEGER,
+  winner INTEGER,
+  loser INTEGER,
+  result text,
+  created timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (ID),
+  FOREIGN KEY (tournament_id) REFERENCES Tournament(ID) ON DELETE CASCADE,
+  CHECK (kind IN ('player_registered', 'player_removed', 'match_reported',
+                  'match_voided', 'matches_cleared'))
+);
+
+-- Index events of a tournament in the order they are replayed
+CREATE INDEX Tournament_Event_Idx ON Tournament_Event (tournament_id, ID);
+
+-- Create table Standings_Snapshot, the standings of a tournament as of an
+-- event, as a json array of [id, name, won, played, drawn, points] arrays
+CREATE TABLE Standings_Snapshot(
+  tournament_id INTEGER NOT NULL,
+  event_id BIGINT NOT NULL,
+  standings json NOT NULL,
+  created timestamp NOT NULL DEFAULT now(),
+  PRIMARY KEY (tournament_id, event_id),
+  FOREIGN KEY (tournament_id) REFERENCES Tournament(ID) ON DELETE CASCADE
+);
+
+-- Taken by every transaction logging events of a tournament before the
+-- event ids are drawn and held until it ends. Snapshots take the lock
+-- exclusively, so every event with a lower id than the latest one they see
+-- has been committed, see tournament.snapshotStandings
+CREATE OR REPLACE FUNCTION lock_events_shared(tournament integer)
+RETURNS void AS $$
+    SELECT pg_advisory_xact_lock_shared(hashtext('Tournament_Event'),
+                                        tournament);
+$$ LANGUAGE sql;
+
+-- Called by every change to a tournament's players or standings, so a
+-- cached copy of its standings is current as long as the version read with
+-- it is, see tournament.cachedStandings
+CREATE OR REPLACE FUNCTION bump_standings_version(tournament_id_arg integer)
+RETURNS void AS $$
+    UPDATE Tournament SET standings_version = standings_version + 1
+        WHERE id = tournament_id_arg;
+$$ LANGUAGE sql;
+
+-- Log every registered and removed player
+CREATE OR REPLACE FUNCTION log_player_event() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_standings_version(NEW.tournament_id);
+        PERFORM lock_events_shared(NEW.tournament_id);
+        INSERT INTO Tournament_Event (tournament_id, kind, player_id, name)
+            VALUES (NEW.tournament_id, 'player_registered', NEW.id, NEW.name);
+        RETURN NEW;
+    END IF;
+    PERFORM bump_standings_version(OLD.tournament_id);
+    PERFORM lock_events_shared(OLD.tournament_id);
+    INSERT INTO Tournament_Event (tournament_id, kind, player_id, name)
+        VALUES (OLD.tournament_id, 'player_removed', OLD.id, OLD.name);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER Player_Event_Trigger
+    AFTER INSERT OR DELETE ON Player
+    FOR EACH ROW EXECUTE PROCEDURE log_player_event();
+
+-- Log every reported and voided match
+CREATE OR REPLACE FUNCTION log_match_event() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_standings_version(NEW.tournament_id);
+        PERFORM lock_events_shared(NEW.tournament_id);
+        INSERT INTO Tournament_Event (tournament_id, kind, match_id, winner,
+                                      loser, result)
+            VALUES (NEW.tournament_id, 'match_reported', NEW.id, NEW.winner,
+                    NEW.loser, NEW.result);
+        RETURN NEW;
+    END IF;
+    PERFORM bump_standings_version(OLD.tournament_id);
+    PERFORM lock_events_shared(OLD.tournament_id);
+    INSERT INTO Tournament_Event (tournament_id, kind, match_id, winner,
+                                  loser, result)
+        VALUES (OLD.tournament_id, 'match_voided', OLD.id, OLD.winner,
+                OLD.loser, OLD.result);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER Match_Event_Trigger
+    AFTER INSERT OR DELETE ON Match
+    FOR EACH ROW EXECUTE PROCEDURE log_match_event();
+
+-- Create a tournament together with its Match partition, returns its id
+CREATE OR REPLACE FUNCTION create_tournament(tournament_name text)
+RETURNS integer AS $$
+DECLARE
+    new_id integer;
+BEGIN
+    INSERT INTO Tournament (name) VALUES (tournament_name)
+        RETURNING id INTO new_id;
+    EXECUTE format('CREATE TABLE Match_%s PARTITION OF Match '
+                   'FOR VALUES IN (%s)', new_id, new_id);
+    RETURN new_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Remove every match of a tournament by truncating its partition, and set
+-- its players' ratings back to the ones they registered with
+CREATE OR REPLACE FUNCTION clear_matches(tournament_id_arg integer)
+RETURNS void AS $$
+BEGIN
+    EXECUTE format('TRUNCATE Match_%s', tournament_id_arg);
+    UPDATE Standing SET won = 0, played = 0, drawn = 0, points = 0
+        WHERE tournament_id = tournament_id_arg;
+    UPDATE Player SET rating = initial_rating
+        WHERE tournament_id = tournament_id_arg;
+    PERFORM bump_standings_version(tournament_id_arg);
+    PERFORM lock_events_shared(tournament_id_arg);
+    INSERT INTO Tournament_Event (tournament_id, kind)
+        VALUES (tournament_id_arg, 'matches_cleared');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop a tournament, its Match partition, players, standings and events
+CREATE OR REPLACE FUNCTION drop_tournament(tournament_id_arg integer)
+RETURNS void AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS Match_%s', tournament_id_arg);
+    -- Players go first, their removal events still need the tournament
+    DELETE FROM Player WHERE tournament_id = tournament_id_arg;
+    DELETE FROM Tournament WHERE id = tournament_id_arg;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the default tournament used when no tournament is given
+SELECT create_tournament('Default');
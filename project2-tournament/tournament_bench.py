@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- benchmarks for the tournament module
+#
+# Usage:
+#   python tournament_bench.py connections [calls]
+#   python tournament_bench.py explain [players] [matches]
+#   python tournament_bench.py pairings [players] [calls]
+#   python tournament_bench.py engine [players ...]
+#   python tournament_bench.py tiebreaks [players] [matches]
+#   python tournament_bench.py standings [players] [matches]
+#   python tournament_bench.py replay [players] [matches]
+#   python tournament_bench.py ratings [players] [rounds]
+#   python tournament_bench.py export [players]
+#   python tournament_bench.py prepared [players] [calls]
+#   python tournament_bench.py suite [results.json|results.csv] [players ...]
+#   python tournament_bench.py compare baseline current [threshold]
+#
+# The benchmarks delete every player and match in the database they run
+# against, point TOURNAMENT_DSN at a scratch database.
+#
+
+import csv
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import event_log
+import pairing
+import ratings
+import tiebreaks
+import tournament
+import tournament_export
+from scoring import BYE, DRAW, WIN
+
+# Operations timed by the suite, in the order they are reported
+SUITE_OPERATIONS = ('registerPlayer', 'swissPairings', 'reportMatch',
+                    'playerStandings')
+# Columns of every suite result row, in the order they are written to CSV
+SUITE_COLUMNS = ('commit', 'players', 'round', 'operation', 'calls',
+                 'mean_ms', 'p50_ms', 'p99_ms')
+# Slowdown of a result against the baseline reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+
+def timeCalls(function, calls):
+    """Call function calls times and return the duration of every call."""
+    durations = []
+    for _ in range(calls):
+        start = time.time()
+        function()
+        durations.append(time.time() - start)
+    return durations
+
+
+def percentile(samples, fraction):
+    """Returns the value below which fraction of the sorted samples fall."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label, durations):
+    """Print mean, p50 and p99 latency of durations in milliseconds."""
+    mean = sum(durations) / len(durations)
+    print '%-28s mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms' % (
+        label, mean * 1000, percentile(durations, 0.5) * 1000,
+        percentile(durations, 0.99) * 1000)
+
+
+def unpooledCount():
+    """countPlayers the way it ran before pooling, one connection per call."""
+    connection = tournament.connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("select count(*) from Player where tournament_id = %s;",
+                       (tournament.DEFAULT_TOURNAMENT,))
+        cursor.fetchall()
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def benchConnections(calls=1000):
+    """Compare per call latency of fresh connections against the pool."""
+    print 'Per call latency over %d calls' % calls
+    report('fresh connection per call', timeCalls(unpooledCount, calls))
+    # Warm the pool up so connection setup is not part of the samples
+    tournament.countPlayers()
+    report('pooled connection', timeCalls(tournament.countPlayers, calls))
+    tournament.closePool()
+
+
+# Queries issued by playerStandings and swissPairings, plus the aggregating
+# view the stored standings are checked against
+EXPLAIN_QUERIES = [
+    ('playerStandings', tournament.STANDINGS_QUERY),
+    ('matchHistory',
+     "SELECT winner, loser, result FROM Match WHERE tournament_id = %s;"),
+    ('Standings_View',
+     "SELECT * FROM Standings_View WHERE tournament_id = %s;"),
+]
+
+
+def seedTournament(players, matches, event=tournament.DEFAULT_TOURNAMENT,
+                   drawRate=0.1):
+    """Replace the event's players and matches with random synthetic ones.
+
+    A drawRate fraction of the matches are draws, the others wins.
+    """
+    tournament.deleteMatches(event)
+    tournament.deletePlayers(event)
+    tournament.executeQuery(
+        """INSERT INTO Player (name, tournament_id)
+           SELECT 'Player ' || i, %s FROM generate_series(1, %s) AS i;""",
+        (event, players), False)
+    # Pick a random winner and a distinct random loser for every match
+    tournament.executeQuery(
+        """INSERT INTO Match (winner, loser, tournament_id, result)
+           SELECT b.lo + r.w, b.lo + (r.w + 1 + r.l) %% b.n, %(event)s,
+                  CASE WHEN random() < %(drawRate)s THEN 'draw'
+                       ELSE 'win' END
+           FROM (SELECT min(id) AS lo, count(*)::int AS n FROM Player
+                 WHERE tournament_id = %(event)s) AS b,
+           LATERAL (SELECT floor(random() * b.n)::int AS w,
+                           floor(random() * (b.n - 1))::int AS l
+                    FROM generate_series(1, %(matches)s)) AS r;""",
+        {'event': event, 'matches': matches, 'drawRate': drawRate}, False)
+    tournament.executeQuery("ANALYZE;", None, False)
+
+
+def benchExplain(players=10000, matches=100000):
+    """Print EXPLAIN ANALYZE plans of the standings and pairing queries."""
+    seedTournament(players, matches)
+    for label, query in EXPLAIN_QUERIES:
+        plan = tournament.executeQuery(
+            "EXPLAIN (ANALYZE, BUFFERS) " + query,
+            (tournament.DEFAULT_TOURNAMENT,), True)
+        print '-- %s (%d players, %d matches)' % (label, players, matches)
+        for (line,) in plan:
+            print line
+        print
+
+
+def legacySwissPairings():
+    """swissPairings as it ran before, with a separate countPlayers query."""
+    standings = tournament.playerStandings()
+    count = tournament.countPlayers()
+    pairings = []
+    for i in range(0, count, 2):
+        group = zip(standings[i], standings[i+1])
+        pairings.append([group[0][0], group[1][0], group[0][1], group[1][1]])
+    return pairings
+
+
+def benchPairings(players=10000, calls=20):
+    """Compare swissPairings against the two query implementation."""
+    # Keep an even field, the old implementation cannot handle a bye
+    seedTournament(players - players % 2, players * 2)
+    print 'swissPairings latency for %d players over %d calls' % (players,
+                                                                  calls)
+    report('standings + countPlayers', timeCalls(legacySwissPairings, calls))
+    report('single standings fetch', timeCalls(tournament.swissPairings,
+                                               calls))
+
+
+def simulateRounds(players, rounds):
+    """Play rounds of random results, returning the seconds spent pairing."""
+    ids = range(1, players + 1)
+    wins = dict((player, 0) for player in ids)
+    opponents = {}
+    byes = set()
+    durations = []
+    for _ in range(rounds):
+        standings = sorted(ids, key=lambda player: -wins[player])
+        start = time.time()
+        pairs, bye = pairing.pairPlayers(standings, opponents, byes)
+        durations.append(time.time() - start)
+        if bye is not None:
+            byes.add(bye)
+            wins[bye] += 1
+        for player1, player2 in pairs:
+            opponents.setdefault(player1, set()).add(player2)
+            opponents.setdefault(player2, set()).add(player1)
+            wins[random.choice((player1, player2))] += 1
+    return durations
+
+
+def benchEngine(sizes=(64, 1024, 8192)):
+    """Time the rematch avoiding pairing engine for every round of events."""
+    for players in sizes:
+        rounds = int(math.ceil(math.log(players, 2))) + 1
+        durations = simulateRounds(players, rounds)
+        print '%5d players, %2d rounds  mean %8.3f ms  max %8.3f ms' % (
+            players, rounds, sum(durations) / rounds * 1000,
+            max(durations) * 1000)
+
+
+def benchTiebreaks(players=10000, matches=100000, calls=5):
+    """Time computing every tiebreak from one fetch worth of matches."""
+    ids = range(1, players + 1)
+    history = []
+    for _ in range(matches):
+        winner, loser = random.sample(ids, 2)
+        history.append((winner, loser,
+                        DRAW if random.random() < 0.1 else WIN))
+    print 'Tiebreaks for %d players and %d matches' % (players, matches)
+    report('computeTiebreaks', timeCalls(
+        lambda: tiebreaks.computeTiebreaks(ids, history), calls))
+
+
+def benchRatings(players=20000, rounds=10, calls=5):
+    """Compare the vectorized season rating recompute with the match loop."""
+    ids = range(1, players + 1)
+    initial = dict((player, ratings.INITIAL_RATING) for player in ids)
+    season = []
+    for _ in range(rounds):
+        random.shuffle(ids)
+        season.extend((ids[i], ids[i + 1],
+                       DRAW if random.random() < 0.1 else WIN)
+                      for i in range(0, players - 1, 2))
+    print 'Ratings of %d players over %d matches' % (players, len(season))
+    report('match by match', timeCalls(
+        lambda: ratings._sequentialRatings(initial, season, ratings.ELO_K),
+        calls))
+    if ratings.numpy is not None:
+        report('vectorized batchRatings', timeCalls(
+            lambda: ratings.batchRatings(initial, season), calls))
+
+
+def peakMemory():
+    """Returns the peak resident memory of the process in megabytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchExport(players=100000):
+    """Compare the streaming CSV export against listing all standings.
+
+    The streaming export runs first, the peak memory of the process only
+    ever grows.
+    """
+    seedTournament(players, 0)
+    print 'Standings export of %d players' % players
+    baseline = peakMemory()
+    with open(os.devnull, 'w') as output:
+        start = time.time()
+        tournament_export.exportCsv(output)
+        print '%-28s %8.3f s  peak memory +%.1f MB' % (
+            'streamed CSV', time.time() - start, peakMemory() - baseline)
+        start = time.time()
+        csv.writer(output).writerows(tournament.playerStandings())
+        print '%-28s %8.3f s  peak memory +%.1f MB' % (
+            'playerStandings list', time.time() - start,
+            peakMemory() - baseline)
+
+
+def unprepared(name):
+    """Returns the text of a prepared statement with %s placeholders."""
+    types, query = tournament.PREPARED_STATEMENTS[name]
+    for number in range(len(types), 0, -1):
+        query = query.replace('$%d' % number, '%s')
+    return query
+
+
+def benchPrepared(players=10000, calls=1000):
+    """Compare per call latency of the hot statements, text and prepared.
+
+    The difference between the two is the parse and plan step.
+    """
+    seedTournament(players, players * 5)
+    event = tournament.createTournament('Prepared benchmark')
+    statements = [
+        ('count_players', (tournament.DEFAULT_TOURNAMENT,), True),
+        ('player_standings', (tournament.DEFAULT_TOURNAMENT,), True),
+        ('register_player', ('Player', event, 1500.0, 1500.0), False),
+    ]
+    print 'Per call latency over %d calls, %d players' % (calls, players)
+    try:
+        for name, values, fetch in statements:
+            query = unprepared(name)
+            plain = timeCalls(lambda: tournament.executeQuery(
+                query, values, fetch), calls)
+            # The text statements repeat parameters used twice
+            count = len(tournament.PREPARED_STATEMENTS[name][0])
+            prepared = timeCalls(lambda: tournament.executePrepared(
+                name, values[:count], fetch), calls)
+            report(name + ' text', plain)
+            report(name + ' prepared', prepared)
+            print '%-28s %.1f%% of the text statement latency' % (
+                'parse and plan', 100 * (1 - percentile(prepared, 0.5) /
+                                         percentile(plain, 0.5)))
+    finally:
+        tournament.deleteTournament(event)
+
+
+# Standings_View as it was before draws and byes, wins and matches only
+LEGACY_STANDINGS_QUERY = """
+    SELECT p.id, p.name, wv.won, mv.played
+    FROM player AS p
+    LEFT JOIN (SELECT p.id, count(m.winner) AS won
+               FROM player AS p LEFT JOIN match AS m
+               ON p.id = m.winner AND p.tournament_id = m.tournament_id
+               GROUP BY p.id) AS wv ON p.id = wv.id
+    LEFT JOIN (SELECT p.id, count(m.player) AS played
+               FROM player AS p LEFT JOIN (
+                   SELECT tournament_id, winner AS player FROM match
+                   UNION ALL
+                   SELECT tournament_id, loser AS player FROM match) AS m
+               ON p.id = m.player AND p.tournament_id = m.tournament_id
+               GROUP BY p.id) AS mv ON p.id = mv.id
+    WHERE p.tournament_id = %s
+    ORDER BY wv.won DESC;"""
+
+
+def benchStandings(players=10000, matches=100000, calls=10):
+    """Compare the standings aggregations with and without match points."""
+    seedTournament(players, matches)
+    event = (tournament.DEFAULT_TOURNAMENT,)
+    print 'Standings of %d players and %d matches over %d calls' % (
+        players, matches, calls)
+    legacy = timeCalls(lambda: tournament.executeQuery(
+        LEGACY_STANDINGS_QUERY, event, True), calls)
+    report('wins only aggregation', legacy)
+    points = timeCalls(lambda: tournament.executeQuery(
+        "SELECT * FROM Standings_View WHERE tournament_id = %s;", event,
+        True), calls)
+    report('Standings_View with points', points)
+    report('Standing table', timeCalls(lambda: tournament.executeQuery(
+        tournament.STANDINGS_QUERY, event, True), calls))
+    report('cached playerStandings', timeCalls(tournament.playerStandings,
+                                               calls))
+    print 'points aggregation costs %.2fx the wins only aggregation' % (
+        sum(points) / sum(legacy))
+
+
+def fullReplay(event=tournament.DEFAULT_TOURNAMENT):
+    """Rebuild the standings from the whole event log, without snapshots."""
+    events = tournament.executeQuery(
+        """SELECT kind, player_id, name, winner, loser, result
+           FROM Tournament_Event WHERE tournament_id = %s ORDER BY id;""",
+        (event,), True)
+    return event_log.replay(None, events)
+
+
+def benchReplay(players=10000, matches=100000, tail=1000, calls=5):
+    """Time rebuilding the standings of a tournament from its event log.
+
+    The tournament is seeded with matches, snapshotted and then gets tail
+    more matches, so standingsAt replays only those from the snapshot.
+    """
+    seedTournament(players, matches)
+    tournament.snapshotStandings()
+    ids = [row[0] for row in tournament.playerStandings()]
+    tournament.reportMatches([random.sample(ids, 2) for _ in range(tail)])
+    print 'Rebuilding standings of %d players and %d matches' % (
+        players, matches + tail)
+    report('full replay', timeCalls(fullReplay, calls))
+    report('snapshot + %d events' % tail, timeCalls(
+        tournament.standingsAt, calls))
+    if sorted(fullReplay()) != sorted(tournament.executeQuery(
+            """SELECT p.id, p.name, s.won, s.played, s.drawn, s.points
+               FROM Standing AS s JOIN Player AS p ON p.id = s.player_id
+               WHERE s.tournament_id = %s;""",
+            (tournament.DEFAULT_TOURNAMENT,), True)):
+        print 'replayed standings differ from the Standing table'
+
+
+def timeCall(durations, function, *args):
+    """Call function with args, appending its duration to durations."""
+    start = time.time()
+    result = function(*args)
+    durations.append(time.time() - start)
+    return result
+
+
+def currentCommit():
+    """Returns the abbreviated hash of the checked out commit, or None."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchTournament(players):
+    """Play a synthetic Swiss tournament, timing every API call made.
+
+    The tournament is created for the run and deleted afterwards, it plays
+    enough rounds to find a single winner.
+
+    Returns:
+      A list with the durations of every round, round 0 being the player
+      registration, as dicts mapping the names in SUITE_OPERATIONS to the
+      durations of their calls in that round.
+    """
+    event = tournament.createTournament('Benchmark suite')
+    registration = {'registerPlayer': []}
+    rounds = [registration]
+    try:
+        for i in range(players):
+            timeCall(registration['registerPlayer'],
+                     tournament.registerPlayer, 'Player %d' % i, event)
+        for _ in range(int(math.ceil(math.log(max(players, 2), 2)))):
+            durations = dict((operation, []) for operation
+                             in SUITE_OPERATIONS[1:])
+            rounds.append(durations)
+            pairings = timeCall(durations['swissPairings'],
+                                tournament.swissPairings, event)
+            for id1, name1, id2, name2 in pairings:
+                if id2 is None:
+                    timeCall(durations['reportMatch'], tournament.reportMatch,
+                             id1, None, event, BYE)
+                    continue
+                winner, loser = random.sample((id1, id2), 2)
+                timeCall(durations['reportMatch'], tournament.reportMatch,
+                         winner, loser, event)
+            timeCall(durations['playerStandings'],
+                     tournament.playerStandings, event)
+    finally:
+        tournament.deleteTournament(event)
+    return rounds
+
+
+def benchSuite(sizes=(64, 1024), path=None):
+    """Run benchTournament for every size and write the result rows.
+
+    Args:
+      sizes: player counts of the synthetic tournaments
+      path: file the rows are written to, as CSV if it ends in .csv and
+        as JSON otherwise, None only prints them
+
+    Returns:
+      The result rows as dicts with the keys in SUITE_COLUMNS.
+    """
+    commit = currentCommit()
+    rows = []
+    for players in sizes:
+        print 'Suite tournament of %d players' % players
+        for number, durations in enumerate(benchTournament(players)):
+            for operation in SUITE_OPERATIONS:
+                samples = durations.get(operation)
+                if not samples:
+                    continue
+                report('round %d %s' % (number, operation), samples)
+                rows.append({
+                    'commit': commit, 'players': players, 'round': number,
+                    'operation': operation, 'calls': len(samples),
+                    'mean_ms': sum(samples) / len(samples) * 1000,
+                    'p50_ms': percentile(samples, 0.5) * 1000,
+                    'p99_ms': percentile(samples, 0.99) * 1000})
+    if path is not None:
+        writeResults(path, rows)
+    return rows
+
+
+def writeResults(path, rows):
+    """Write suite result rows to path as CSV or JSON, see benchSuite."""
+    with open(path, 'wb' if path.endswith('.csv') else 'w') as output:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(output, SUITE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, output, indent=2, sort_keys=True)
+
+
+def readResults(path):
+    """Read suite result rows written by writeResults."""
+    with open(path, 'rb' if path.endswith('.csv') else 'r') as results:
+        if not path.endswith('.csv'):
+            return json.load(results)
+        rows = list(csv.DictReader(results))
+    for row in rows:
+        row['players'] = int(row['players'])
+        row['round'] = int(row['round'])
+        for column in ('calls', 'mean_ms', 'p50_ms', 'p99_ms'):
+            row[column] = float(row[column])
+    return rows
+
+
+def compareResults(baseline, current, threshold=REGRESSION_THRESHOLD,
+                   metric='p50_ms'):
+    """Print every operation's change against the baseline.
+
+    Args:
+      baseline: result rows of the reference run, see benchSuite
+      current: result rows of the run to check
+      threshold: slowdown fraction, 0.1 reports operations more than 10%
+        slower than the baseline
+      metric: result column compared
+
+    Returns:
+      The (players, round, operation, baseline, current) tuples of
+      regressions.
+    """
+    reference = dict(((row['players'], row['round'], row['operation']),
+                      row[metric]) for row in baseline)
+    regressions = []
+    print '%7s %5s %-16s %12s %12s %8s' % ('players', 'round', 'operation',
+                                           'baseline', 'current', 'change')
+    for row in current:
+        key = (row['players'], row['round'], row['operation'])
+        if key not in reference:
+            continue
+        before, after = reference[key], row[metric]
+        change = after / before - 1 if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(key + (before, after))
+            flag = '  REGRESSION'
+        print '%7d %5d %-16s %9.3f ms %9.3f ms %+7.1f%%%s' % (
+            key + (before, after, change * 100, flag))
+    print '%d regressions over %.0f%% in %s' % (len(regressions),
+                                                threshold * 100, metric)
+    return regressions
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'connections'
+    if command == 'connections':
+        calls = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        benchConnections(calls)
+    elif command == 'explain':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        matches = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+        benchExplain(players, matches)
+    elif command == 'pairings':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        calls = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        benchPairings(players, calls)
+    elif command == 'engine':
+        sizes = [int(size) for size in sys.argv[2:]] or [64, 1024, 8192]
+        benchEngine(sizes)
+    elif command == 'tiebreaks':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        matches = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+        benchTiebreaks(players, matches)
+    elif command == 'standings':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        matches = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+        benchStandings(players, matches)
+    elif command == 'replay':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        matches = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+        benchReplay(players, matches)
+    elif command == 'ratings':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        benchRatings(players, rounds)
+    elif command == 'export':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        benchExport(players)
+    elif command == 'prepared':
+        players = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        calls = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        benchPrepared(players, calls)
+    elif command == 'suite':
+        path = sys.argv[2] if len(sys.argv) > 2 else None
+        sizes = [int(size) for size in sys.argv[3:]] or [64, 1024]
+        benchSuite(sizes, path)
+    elif command == 'compare':
+        threshold = (float(sys.argv[4]) if len(sys.argv) > 4
+                     else REGRESSION_THRESHOLD)
+        if compareResults(readResults(sys.argv[2]), readResults(sys.argv[3]),
+                          threshold):
+            sys.exit(1)
+    else:
+        sys.exit('unknown benchmark: %s' % command)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# tournament_export.py -- streaming CSV and JSON lines export of standings
+#
+# Usage:
+#   python tournament_export.py csv [tournament] > standings.csv
+#   python tournament_export.py jsonl [tournament] > standings.jsonl
+#
+# Rows are written batch by batch as they are read from the database, so
+# memory use stays flat whatever the number of players.
+#
+
+import csv
+import json
+import sys
+from collections import OrderedDict
+
+import tournament
+
+# Columns of every exported standings row
+COLUMNS = ('id', 'name', 'wins', 'matches')
+
+
+def exportCsv(output, event=tournament.DEFAULT_TOURNAMENT,
+              batchSize=tournament.STREAM_BATCH_SIZE):
+    """Writes the standings of a tournament to a file object as CSV.
+
+    Args:
+      output: file object the rows are written to, after a header row
+      event: the id of the tournament
+      batchSize: rows read from the database at a time
+
+    Returns:
+      The number of players written.
+    """
+    writer = csv.writer(output)
+    writer.writerow(COLUMNS)
+    count = 0
+    for batch in tournament.streamStandings(event, batchSize):
+        writer.writerows(batch)
+        count += len(batch)
+    return count
+
+
+def exportJsonLines(output, event=tournament.DEFAULT_TOURNAMENT,
+                    batchSize=tournament.STREAM_BATCH_SIZE):
+    """Writes the standings of a tournament to a file object as JSON lines.
+
+    Every player is written as one JSON object with the keys in COLUMNS on
+    a line of its own.
+
+    Args:
+      output: file object the rows are written to
+      event: the id of the tournament
+      batchSize: rows read from the database at a time
+
+    Returns:
+      The number of players written.
+    """
+    count = 0
+    for batch in tournament.streamStandings(event, batchSize):
+        output.writelines(json.dumps(OrderedDict(zip(COLUMNS, row))) + '\n'
+                          for row in batch)
+        count += len(batch)
+    return count
+
+
+EXPORTERS = {'csv': exportCsv, 'jsonl': exportJsonLines}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in EXPORTERS:
+        sys.exit('usage: tournament_export.py csv|jsonl [tournament]')
+    event = (int(sys.argv[2]) if len(sys.argv) > 2
+             else tournament.DEFAULT_TOURNAMENT)
+    EXPORTERS[sys.argv[1]](sys.stdout, event)
@@ -1,7 +1,15 @@
 #!/usr/bin/env python
 #
 # Test cases for tournament.py
+#
+# Usage:
+#   python tournament_test.py           run against PostgreSQL
+#   python tournament_test.py memory    run against the in-memory backend
+
+import sys
 
+import instrumentation
+import pairing_runner
 from tournament import *
 
 
@@ -128,7 +136,374 @@ def testPairings():
     print "8. After one match, players with one win are paired."
 
 
+def testBulkRegisterAndReport():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Rarity", "Spike", "Big Mac", "Zecora"])
+    if countPlayers() != 4:
+        raise ValueError(
+            "After registering four players in bulk, countPlayers should "
+            "be 4.")
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatches([(id1, id2), (id3, str(id4))])
+    for (i, n, w, m) in playerStandings():
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+    try:
+        reportMatches([(id1, id3), (id2, "Spike")])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportMatches should reject non integer ids.")
+    if sum(m for (i, n, w, m) in playerStandings()) != 4:
+        raise ValueError("A rejected round should not record any match.")
+    print "9. Players and matches can be recorded in bulk."
+
+
+def testStandingsConsistent():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Trixie", "Derpy", "Lyra", "Bon Bon"])
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatch(id1, id3)
+    if checkStandings():
+        raise ValueError(
+            "Stored standings should match the standings aggregated from "
+            "the matches.")
+    (leader, name, wins, matches) = playerStandings()[0]
+    if (leader, wins, matches) != (id1, 2, 2):
+        raise ValueError("The player with most wins should lead standings.")
+    print "10. Stored standings agree with the recorded matches."
+
+
+def testOddPairings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Rainbow Dash", "Scootaloo", "Sweetie Belle"])
+    standings = playerStandings()
+    [id1, id2, id3] = [row[0] for row in standings]
+    reportMatch(id1, id2)
+    pairings = swissPairings()
+    if len(pairings) != 2:
+        raise ValueError(
+            "For three players, swissPairings should return a pair and a bye.")
+    [(pid1, pname1, pid2, pname2), (bid, bname, bid2, bname2)] = pairings
+    if (bid2, bname2) != (None, None):
+        raise ValueError("The last pairing should be a bye without opponent.")
+    if set([pid1, pid2, bid]) != set([id1, id2, id3]):
+        raise ValueError("Every player should appear exactly once.")
+    if pid1 != id1:
+        raise ValueError("The leading player should not get the bye.")
+    print "11. With an odd number of players one player gets a bye."
+
+
+def testNoRematches():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Celestia", "Luna", "Cadance", "Shining Armor"])
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatches([(id1, id3), (id2, id4)])
+    # Adjacent pairing would now pair the leader with a former opponent
+    pairings = swissPairings()
+    actual_pairs = set([frozenset([pid1, pid2])
+                        for (pid1, pname1, pid2, pname2) in pairings])
+    if actual_pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError("swissPairings should avoid rematches.")
+    print "12. Players who already met are not paired again."
+
+
+def testSeparateTournaments():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Starlight Glimmer", "Sunburst"])
+    side = createTournament("Side event")
+    registerPlayers(["Maud Pie", "Mudbriar", "Coco Pommel"], side)
+    if countPlayers() != 2 or countPlayers(side) != 3:
+        raise ValueError("Players should be counted per tournament.")
+    [id1, id2, id3] = [row[0] for row in playerStandings(side)]
+    reportMatch(id1, id2, side)
+    if sum(row[3] for row in playerStandings()) != 0:
+        raise ValueError(
+            "A match in one tournament should not show up in another one.")
+    deleteMatches(side)
+    if sum(row[3] for row in playerStandings(side)) != 0:
+        raise ValueError("After deleting, no matches should be recorded.")
+    deleteTournament(side)
+    if countPlayers(side) != 0 or countPlayers() != 2:
+        raise ValueError(
+            "Deleting a tournament should only remove its own players.")
+    print "13. Tournaments keep their players and matches apart."
+
+
+def testTiebreaks():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Discord", "Tirek", "Chrysalis", "Cozy Glow"])
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatches([(id1, id3), (id4, id2)])
+    standings = playerStandings(tiebreaks=["buchholz", "omw"])
+    if len(standings[0]) != 7:
+        raise ValueError(
+            "Standings with tiebreaks should have seven columns.")
+    if [row[0] for row in standings] != [id1, id3, id4, id2]:
+        raise ValueError(
+            "Players tied on wins should be ranked by their tiebreaks.")
+    (i, n, w, m, omw, buchholz, sonnebornBerger) = standings[1]
+    if (buchholz, sonnebornBerger) != (3, 1):
+        raise ValueError("Buchholz and Sonneborn-Berger should add up the "
+                         "scores of the opponents played and beaten.")
+    print "14. Tiebreaks rank players tied on wins."
+
+
+def testDrawsAndByes():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Sunset Shimmer", "Tempest Shadow", "Sombra"])
+    standings = playerStandings()
+    [id1, id2, id3] = [row[0] for row in standings]
+    reportMatch(id1, id2, result=DRAW, games=(1, 1))
+    reportMatch(id3, None, result=BYE)
+    standings = playerStandings()
+    if standings[0][:4] != (id3, "Sombra", 1, 1):
+        raise ValueError("A bye should count as a won match.")
+    for (i, n, w, m) in standings[1:]:
+        if (w, m) != (0, 1):
+            raise ValueError("A draw should count as a match without a win.")
+    if checkStandings():
+        raise ValueError(
+            "Stored standings should match the standings aggregated from "
+            "the matches.")
+    pairings = swissPairings()
+    (bid, bname, bid2, bname2) = pairings[-1]
+    if bid == id3 or bid2 is not None:
+        raise ValueError("A player should not get a second bye.")
+    try:
+        reportMatch(id1, id2, result="forfeit")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportMatch should reject unknown results.")
+    print "15. Draws and byes are recorded and a bye is not repeated."
+
+
+def testEventReplay():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Trixie", "Starlight", "Gilda", "Lightning Dust"])
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings()]
+    reportMatches([(id1, id2), (id3, id4)])
+    before = sorted(playerStandings())
+    event = lastEvent()
+    snapshotStandings()
+    [match] = reportMatches([(id2, id1)])
+    if sorted(standingsAt()) != sorted(playerStandings()):
+        raise ValueError(
+            "Replaying the event log should give the current standings.")
+    voidMatch(match)
+    if (sorted(playerStandings()) != before or
+            sorted(standingsAt(event=event)) != before):
+        raise ValueError("Voiding a match should restore the standings and "
+                         "the log should replay earlier standings.")
+    if sorted(standingsAt()) != before:
+        raise ValueError("A voided match should be replayed as removed.")
+    print "16. The event log replays standings as of any event."
+
+
+def testQueryErrors():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Flim", "Flam"])
+    [id1, id2] = [row[0] for row in playerStandings()]
+    stats = instrumentation.QueryStats()
+    instrumentation.addHook(stats)
+    try:
+        reportMatch(id1, id2 + 1000)
+    except (ValueError, TournamentError):
+        pass
+    else:
+        raise ValueError("Reporting a match of an unregistered player should "
+                         "raise an error.")
+    finally:
+        instrumentation.removeHook(stats)
+    # Only the PostgreSQL backend runs statements
+    counters = stats.counters().values()
+    if counters and sum(errors for c, errors, r, s, a in counters) != 1:
+        raise ValueError("Query hooks should count the failed statement.")
+    if counters:
+        def failingExecute(cursor):
+            raise KeyError("not a database error")
+        stats.reset()
+        instrumentation.addHook(stats)
+        try:
+            runStatement("SELECT 1;", failingExecute)
+        except KeyError:
+            pass
+        finally:
+            instrumentation.removeHook(stats)
+        if [c[1] for c in stats.counters().values()] != [1]:
+            raise ValueError("Query hooks should count any failure.")
+    print "17. Failed statements raise errors and are counted."
+
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Applejack", "Rarity", "Fluttershy", "Rainbow Dash"],
+                    initialRatings=[1600, 1400, 1500, 1700])
+    [dash, applejack, fluttershy, rarity] = [
+        row[0] for row in playerRatings()]
+    pairings = swissPairings(seedByRating=True)
+    if [(id1, id2) for (id1, n1, id2, n2) in pairings] != [
+            (dash, fluttershy), (applejack, rarity)]:
+        raise ValueError("The first round should pair the top half of the "
+                         "ratings against the bottom half.")
+    reportMatches([(rarity, applejack), (dash, fluttershy)])
+    ratings = dict((i, r) for (i, n, r) in playerRatings())
+    if not ratings[rarity] - 1400 > ratings[dash] - 1700 > 0:
+        raise ValueError("An upset should gain more rating than a win of "
+                         "the favourite.")
+    if abs(sum(ratings.values()) - 6200) > 1e-6:
+        raise ValueError("The loser should lose what the winner gains.")
+    recomputeRatings()
+    for (i, n, r) in playerRatings():
+        if abs(r - ratings[i]) > 1e-6:
+            raise ValueError("Recomputed ratings should match the ratings "
+                             "updated match by match.")
+    for initialRatings in ([1600], []):
+        try:
+            registerPlayers(["Spike", "Starlight"],
+                            initialRatings=initialRatings)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Every player should get an initial rating.")
+    if countPlayers() != 4:
+        raise ValueError("Players without a rating should not register.")
+    print "18. Ratings move with every match and seed the first round."
+
+
+def testStandingsCache():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Zecora", "Cheerilee"])
+    playerStandings()
+    before = standingsCacheStats()
+    [id1, id2] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2)
+    standings = playerStandings()
+    if (standings[0][0], standings[0][2]) != (id1, 1):
+        raise ValueError("Reporting a match should invalidate cached "
+                         "standings.")
+    stats = standingsCacheStats()
+    # Only the PostgreSQL backend reads standings through the cache
+    if stats['misses'] and (stats['hits'] - before['hits'],
+                            stats['misses'] - before['misses']) != (1, 1):
+        raise ValueError("Repeated reads should be served from the cache.")
+    if stats['misses']:
+        # A change made without this module, as by another process
+        executeQuery("DELETE FROM Match WHERE tournament_id = %s;",
+                     (DEFAULT_TOURNAMENT,), False)
+        if playerStandings()[0][2] != 0:
+            raise ValueError("Changes made elsewhere should invalidate "
+                             "cached standings.")
+    print "19. Standings are cached until a match is reported."
+
+
+def testStreamStandings():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Pinkie Pie", "Maud Pie", "Limestone Pie", "Marble Pie",
+                     "Cheese Sandwich"])
+    [id1, id2, id3, id4, id5] = [row[0] for row in playerStandings()]
+    reportMatches([(id1, id2), (id3, id4), (id5, None, BYE)])
+    batches = list(streamStandings(batchSize=2))
+    if [len(batch) for batch in batches] != [2, 2, 1]:
+        raise ValueError("Standings should be streamed in batches.")
+    if ([row[2:] for batch in batches for row in batch] !=
+            [row[2:] for row in playerStandings()]):
+        raise ValueError("Streamed standings should be ranked like "
+                         "playerStandings.")
+    print "20. Standings can be streamed in batches."
+
+
+def testPairingRunner():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Spike", "Thorax", "Ember", "Smolder"])
+    side = createTournament("Dragon lands")
+    registerPlayers(["Garble", "Torch", "Sludge"], side)
+    results = pairing_runner.pairTournaments([DEFAULT_TOURNAMENT, side], 2)
+    if [(r.tournament, r.error) for r in results] != [
+            (DEFAULT_TOURNAMENT, None), (side, None)]:
+        raise ValueError("Every tournament should be paired in order.")
+    if [len(r.pairings) for r in results] != [2, 2]:
+        raise ValueError("The runner should pair like swissPairings.")
+    if countPlayers() != 4 or len(swissPairings()) != 2:
+        raise ValueError("The parent should keep working after the run.")
+    deleteTournament(side)
+    print "21. Many tournaments are paired concurrently."
+
+
+def testBrackets():
+    deleteMatches()
+    deletePlayers()
+    registerPlayers(["Applejack", "Big Mac", "Granny Smith", "Apple Bloom",
+                     "Braeburn"])
+    ids = sorted(row[0] for row in playerStandings())
+    schedule = scheduleRoundRobin()
+    if len(set(row[0] for row in schedule)) != 5:
+        raise ValueError("Five players should play five rounds.")
+    games = [frozenset(row[1:]) for row in schedule if row[2] is not None]
+    if len(games) != 10 or len(set(games)) != 10:
+        raise ValueError("Every player should meet every other one once.")
+    reportMatches([(ids[0], ids[1]), (ids[2], ids[3]), (ids[0], ids[2])])
+    seeds = [row[0] for row in playerStandings()]
+    try:
+        scheduleElimination(size=1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A bracket needs at least two players.")
+    first = scheduleElimination()
+    if [row[1:] for row in first] != [(seeds[0], None), (seeds[3], seeds[4]),
+                                      (seeds[1], None), (seeds[2], None)]:
+        raise ValueError("The top seeds should get the byes.")
+    if scheduledPairings() != first:
+        raise ValueError("The schedule should replace the round-robin.")
+    try:
+        advanceElimination()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round cannot advance before it is played.")
+    reportMatch(seeds[4], seeds[3])
+    second = advanceElimination()
+    if [row[1:] for row in second] != [(seeds[0], seeds[4]),
+                                       (seeds[1], seeds[2])]:
+        raise ValueError("The winners should meet in bracket order.")
+    reportMatch(seeds[0], seeds[4])
+    reportMatch(seeds[2], seeds[1])
+    if [row[1:] for row in advanceElimination()] != [(seeds[0], seeds[2])]:
+        raise ValueError("The final should follow the semi-finals.")
+    reportMatch(seeds[2], seeds[0])
+    if advanceElimination() != [] or len(scheduledPairings(round=3)) != 1:
+        raise ValueError("Nothing should be scheduled after the final.")
+    print "22. Elimination and round-robin brackets are scheduled."
+
+
 if __name__ == '__main__':
+    if sys.argv[1:] == ['memory']:
+        from memory_backend import MemoryBackend
+        setBackend(MemoryBackend())
     testDeleteMatches()
     testDelete()
     testCount()
@@ -137,4 +512,18 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testBulkRegisterAndReport()
+    testStandingsConsistent()
+    testOddPairings()
+    testNoRematches()
+    testSeparateTournaments()
+    testTiebreaks()
+    testDrawsAndByes()
+    testEventReplay()
+    testQueryErrors()
+    testRatings()
+    testStandingsCache()
+    testStreamStandings()
+    testPairingRunner()
+    testBrackets()
     print "Success!  All tests pass!"
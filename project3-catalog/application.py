@@ -1,4 +1,3 @@
-import io
 import os
 import random
 import string
@@ -9,11 +8,13 @@ import bleach
 from functools import wraps
 
 from flask import Flask, render_template, redirect, url_for, request
-from flask import send_file, jsonify, flash
+from flask import send_file, flash, abort, Response, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
+import image_store
 from database_setup import Base, Category, CategoryItem
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, joinedload, load_only
 from sqlalchemy import desc
 from flask import session as login_session
 
@@ -36,10 +37,101 @@ engine = create_engine('sqlite:///catalog.db')
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
 session = DBSession()
-# Upload folder relative path for images
-RELATIVE_PATH = os.path.join(os.path.dirname(__file__), 'static/uploads')
-# Upload folder absolute path for images
-UPLOAD_FOLDER = os.path.abspath(RELATIVE_PATH)
+# Items per page of the item lists when the request sets no limit
+PAGE_SIZE = 20
+# Most items a page of the item lists may ask for
+MAX_PAGE_SIZE = 100
+# Items the exports fetch per round trip while streaming
+EXPORT_BATCH_SIZE = 1000
+# Item columns the list pages and exports render, the image columns are
+# left out
+LIST_COLUMNS = ('id', 'name', 'description', 'category_id')
+
+
+def list_items():
+    '''Query the rendered item columns with the category joined in
+
+    Selecting the category in the same statement saves one lazy load per
+    item when the list shows item.category.name.
+    '''
+    return session.query(CategoryItem).options(
+        load_only(*LIST_COLUMNS),
+        joinedload(CategoryItem.category).load_only('name'))
+
+
+def page_arguments(allow_all=False):
+    '''Read the paging arguments of the request
+
+    The before argument is the item id a page starts below and limit the
+    page size, up to MAX_PAGE_SIZE. With allow_all, limit=all asks for
+    every item.
+
+    Returns a (limit, before) tuple, limit is None for every item.
+    '''
+    if allow_all and request.args.get('limit') == 'all':
+        limit = None
+    else:
+        limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1),
+                    MAX_PAGE_SIZE)
+    return limit, request.args.get('before', type=int)
+
+
+def page_query(query, limit, before):
+    '''Order the query newest first from the item below before
+
+    Pages are keyset paginated on the item id, so every page is one index
+    range scan however deep it is. One row more than limit is fetched to
+    tell whether there is a next page.
+    '''
+    if before is not None:
+        query = query.filter(CategoryItem.id < before)
+    query = query.order_by(desc(CategoryItem.id))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def item_page(query, endpoint, **values):
+    '''Fetch one page of the query's items, see page_arguments
+
+    Returns an (items, next_url) tuple, next_url is the url of endpoint
+    with values for the next page, None on the last page.
+    '''
+    limit, before = page_arguments()
+    items = page_query(query, limit, before).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, url_for(endpoint, before=items[-1].id, limit=limit,
+                          **values)
+
+
+class ExportPage(object):
+    '''One page of an export, read from the database while it is iterated
+
+    The items are fetched EXPORT_BATCH_SIZE at a time and only the current
+    batch is held in memory, so even limit=all exports of the whole catalog
+    run in constant memory. next_url is set once the page has been
+    iterated, to the url of endpoint for the next page or None on the last
+    one.
+    '''
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.limit, before = page_arguments(allow_all=True)
+        self.query = page_query(list_items(), self.limit, before)
+        self.next_url = None
+
+    def __iter__(self):
+        last_id = None
+        for count, item in enumerate(
+                self.query.yield_per(EXPORT_BATCH_SIZE)):
+            if count == self.limit:
+                self.next_url = url_for(self.endpoint, before=last_id,
+                                        limit=self.limit)
+                break
+            last_id = item.id
+            yield item
 
 
 def login_required(f):
@@ -62,12 +154,11 @@ def login_required(f):
 def home():
     # Fetch all the categories to display
     categories = session.query(Category).all()
-    # Fetch latest items list based on latest inserted id's
-    latest_items = session.query(CategoryItem).order_by(
-        desc(CategoryItem.id)).all()
+    # Fetch a page of the latest items based on latest inserted id's
+    latest_items, next_url = item_page(list_items(), 'home')
     # Render home page to using the passed in params
     return render_template('index.html', categories=categories,
-                           latest_items=latest_items,
+                           latest_items=latest_items, next_url=next_url,
                            STATE=login_session['state'],
                            logged_in=login_session['logged_in'])
 
@@ -163,26 +254,58 @@ def gconnect():
 # Display catalog as json response
 @app.route('/catalog.json', methods=['GET', 'POST'])
 def items_json():
-    categories = session.query(CategoryItem).all()
-    return jsonify(CategoryItem=[i.serialize for i in categories])
+    page = ExportPage('items_json')
+
+    def generate():
+        yield '{"CategoryItem": ['
+        for count, item in enumerate(page):
+            yield (', ' if count else '') + json.dumps(item.serialize)
+        yield '], "next": %s}' % json.dumps(page.next_url)
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
 
 
 # Display catalog as xml response
 @app.route('/catalog.xml')
 def items_xml():
-    items = session.query(CategoryItem).all()
-    resp = make_response(render_template('catalog.xml', items=items))
-    resp.headers['Content-type'] = 'text/xml; charset=utf-8'
-    return resp
+    context = {'page': ExportPage('items_xml')}
+    app.update_template_context(context)
+    # Render the template element by element as the response is sent
+    stream = app.jinja_env.get_template('catalog.xml').stream(context)
+    stream.enable_buffering(100)
+    return Response(stream_with_context(stream),
+                    content_type='text/xml; charset=utf-8')
 
 
 # Fetch binary and display image based on item id
 @app.route("/images/<int:item_id>.jpg")
 def getImage(item_id):
-    item = session.query(CategoryItem).filter_by(id=item_id).one()
-    return send_file(io.BytesIO(item.image),
-                     attachment_filename='logo.png',
-                     mimetype='image/png')
+    # Only the hash is read, the image itself comes from the image store
+    image_hash = session.query(CategoryItem.image_hash).filter_by(
+        id=item_id).scalar()
+    if image_hash is None:
+        abort(404)
+    path = image_store.image_path(image_hash)
+    try:
+        size = os.path.getsize(path)
+        resp = send_file(path,
+                         mimetype=image_store.image_mimetype(image_hash),
+                         add_etags=False, cache_timeout=0)
+    except (IOError, OSError):
+        # The item names an image missing from the store
+        abort(404)
+    # The hash names the exact bytes, a strong ETag. Browsers revalidate
+    # on every view since an edit replaces the image behind the same url,
+    # which costs one 304 answer while the image is unchanged
+    resp.set_etag(image_hash)
+    resp.cache_control.no_cache = True
+    resp.headers['Accept-Ranges'] = 'bytes'
+    try:
+        return resp.make_conditional(request, accept_ranges=True,
+                                     complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        resp.close()
+        raise
 
 
 # Items route to display all categoris and  items for a specific category
@@ -194,11 +317,12 @@ def items(category_name):
     # Fetch selected category
     selected_category = session.query(
         Category).filter_by(name=category_name).one()
-    # Fetch all items for the selected category
-    latest_items = session.query(CategoryItem).filter_by(
-        category_id=selected_category.id).all()
+    # Fetch a page of the items of the selected category
+    latest_items, next_url = item_page(
+        list_items().filter_by(category_id=selected_category.id), 'items',
+        category_name=category_name)
     return render_template('items.html', categories=categories,
-                           latest_items=latest_items,
+                           latest_items=latest_items, next_url=next_url,
                            category_name=category_name,
                            STATE=login_session['state'],
                            logged_in=login_session['logged_in'])
@@ -211,7 +335,7 @@ def item(category_name, item_name):
     # Fetch all categories
     categories = session.query(Category).all()
     # Fetch all items based on item name
-    latest_items = session.query(CategoryItem).filter_by(name=item_name).all()
+    latest_items = list_items().filter_by(name=item_name).all()
     return render_template('item.html', categories=categories,
                            latest_items=latest_items,
                            category_name=category_name,
@@ -265,12 +389,11 @@ def edit_item(category_name, item_name, item_id):
                                    category=selected_category)
             # get the image file
             file = request.files['file']
-            # save it on the server and in the database
+            # save it in the image store, the database keeps its hash
             if file:
-                file.save(os.path.join(UPLOAD_FOLDER, file.filename))
-                with open(UPLOAD_FOLDER + '/' + file.filename, "rb") as ifile:
-                    image_blob = ifile.read()
-                newItem.image = image_blob
+                image_hash, image_size = image_store.save_image(file.read())
+                newItem.image_hash = image_hash
+                newItem.image_size = image_size
             session.add(newItem)
             session.commit()
             flash("Added item Successfully ")
@@ -295,12 +418,11 @@ def edit_item(category_name, item_name, item_id):
                 CategoryItem).filter_by(id=item_id).one()
             # Get the name of the uploaded file
             file = request.files['file']
-            # save it on the server and in the database
+            # save it in the image store, the database keeps its hash
             if file:
-                file.save(os.path.join(UPLOAD_FOLDER, file.filename))
-                with open(UPLOAD_FOLDER + '/' + file.filename, "rb") as ifile:
-                    image_blob = ifile.read()
-                selected_Item.image = image_blob
+                image_hash, image_size = image_store.save_image(file.read())
+                selected_Item.image_hash = image_hash
+                selected_Item.image_size = image_size
             # Update all the other attributers
             selected_Item.name = request.form['name']
             selected_Item.description = request.form['description']
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Test cases for the catalog application
+#
+# application.py and database_setup.py open catalog.db in the working
+# directory, so the tests run in a scratch folder with a database of its own.
+
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy import event
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+SCRATCH = tempfile.mkdtemp()
+shutil.copy(os.path.join(HERE, 'client_secrets.json'), SCRATCH)
+os.chdir(SCRATCH)
+
+import application  # noqa
+import image_store  # noqa
+from database_setup import Category, CategoryItem  # noqa
+
+image_store.IMAGE_FOLDER = os.path.join(SCRATCH, 'images')
+
+# Items the streamed export test adds to the catalog
+EXPORT_ITEMS = 50000
+# Most memory exporting them may add to the peak, in kilobytes
+EXPORT_MEMORY_KB = 8 * 1024
+
+# Pages and exports listing many items at once
+LIST_PAGES = ['/', '/catalog/Soccer/items', '/catalog/Soccer/Jersey',
+              '/catalog.json', '/catalog.xml']
+
+statements = []
+
+
+@event.listens_for(application.engine, 'before_cursor_execute')
+def recordStatement(conn, cursor, statement, parameters, context, many):
+    statements.append(statement)
+
+
+def countStatements(path):
+    """Returns the statements a GET of path runs on a fresh session."""
+    application.session.close()
+    del statements[:]
+    response = application.app.test_client().get(path)
+    if response.status_code != 200:
+        raise ValueError("GET %s answered %d." % (path, response.status_code))
+    return list(statements)
+
+
+def addItems(count, first=0):
+    """Adds count items, every one in a category of its own."""
+    session = application.session
+    for number in range(first, first + count):
+        category = Category(name="Category %d" % number)
+        session.add(category)
+        session.add(CategoryItem(name="Item %d" % number,
+                                 description="description", category=category,
+                                 image_hash="0" * 64, image_size=1))
+    session.commit()
+
+
+def testConstantQueries():
+    before = dict((path, len(countStatements(path))) for path in LIST_PAGES)
+    addItems(50)
+    for path in LIST_PAGES:
+        count = len(countStatements(path))
+        if count != before[path]:
+            raise ValueError("GET %s ran %d statements with 50 more items, "
+                             "%d before." % (path, count, before[path]))
+    print "1. List pages run the same number of statements for any item count."
+
+
+def testListColumns():
+    for path in LIST_PAGES:
+        for statement in countStatements(path):
+            if 'image_hash' in statement and 'category_item' in statement:
+                raise ValueError("GET %s selected the image columns." % path)
+    print "2. List pages only select the columns they render."
+
+
+def testKeysetPages():
+    addItems(60, 50)
+    client = application.app.test_client()
+    ids = []
+    path = '/catalog.json?limit=7'
+    while path:
+        page = json.loads(client.get(path).data)
+        if len(page['CategoryItem']) > 7:
+            raise ValueError("A page should hold at most limit items.")
+        ids.extend(item['id'] for item in page['CategoryItem'])
+        path = page['next']
+    everything = [item.id for item in application.session.query(
+        CategoryItem).order_by(CategoryItem.id.desc())]
+    if ids != everything:
+        raise ValueError("The next links should walk every item once, "
+                         "newest first.")
+    page = json.loads(client.get('/catalog.json?limit=100000').data)
+    if len(page['CategoryItem']) != application.MAX_PAGE_SIZE:
+        raise ValueError("The page size should be capped.")
+    if '<next>' not in client.get('/catalog.xml?limit=1').data:
+        raise ValueError("The XML export should link to its next page.")
+    print "3. Item lists are paged by id with next links."
+
+
+def addExportItems(count):
+    """Adds count items, inserted in batches of 1000 rows."""
+    insert = CategoryItem.__table__.insert()
+    for first in range(0, count, 1000):
+        application.engine.execute(insert, [
+            {'name': "Export %d" % number, 'description': "description",
+             'category_id': 1}
+            for number in range(first, min(first + 1000, count))])
+
+
+def exportPeakGrowth():
+    """Streams every export and returns how far the peak memory rose."""
+    client = application.app.test_client()
+    application.session.close()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for path in ['/catalog.json?limit=all', '/catalog.xml?limit=all']:
+        response = client.get(path, buffered=False)
+        for chunk in response.response:
+            pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak
+
+
+def testStreamedExports():
+    # A first round sets the peak of exporting a smaller catalog, exporting
+    # five times the items must not raise it much further
+    addExportItems(EXPORT_ITEMS // 5)
+    exportPeakGrowth()
+    addExportItems(EXPORT_ITEMS - EXPORT_ITEMS // 5)
+    growth = exportPeakGrowth()
+    if growth > EXPORT_MEMORY_KB:
+        raise ValueError("Exporting %d more items raised the peak memory by "
+                         "%d KB." % (EXPORT_ITEMS, growth))
+    client = application.app.test_client()
+    if json.loads(client.get('/catalog.json?limit=all').data)['next']:
+        raise ValueError("An export of every item has no next page.")
+    print "4. Exports of every item are streamed in constant memory."
+
+
+def testImageCaching():
+    image = '\x89PNG\r\n\x1a\n' + 'pixels' * 100
+    image_hash, image_size = image_store.save_image(image)
+    if os.stat(image_store.image_path(image_hash)).st_mode & 0o777 != 0o644:
+        raise ValueError("Stored images should be readable by everyone.")
+    item = application.session.query(CategoryItem).first()
+    item.image_hash, item.image_size = image_hash, image_size
+    application.session.commit()
+    client = application.app.test_client()
+    path = '/images/%d.jpg' % item.id
+    response = client.get(path)
+    if response.data != image or response.mimetype != 'image/png':
+        raise ValueError("The image should be served as image/png.")
+    if response.headers['ETag'] != '"%s"' % image_hash:
+        raise ValueError("The ETag should be the hash of the image.")
+    if 'no-cache' not in response.headers['Cache-Control'] or \
+            'Last-Modified' not in response.headers:
+        raise ValueError("Browsers should revalidate the image.")
+    response = client.get(path, headers={'If-None-Match': '"%s"' %
+                                         image_hash})
+    if response.status_code != 304 or response.data:
+        raise ValueError("An unchanged image should answer 304.")
+    response = client.get(path, headers={'Range': 'bytes=8-13'})
+    if response.status_code != 206 or response.data != 'pixels' or \
+            response.headers['Content-Range'] != 'bytes 8-13/%d' % image_size:
+        raise ValueError("A range of the image should answer 206.")
+    item.image_hash = "0" * 64
+    application.session.commit()
+    if client.get(path).status_code != 404:
+        raise ValueError("An image missing from the store should answer "
+                         "404.")
+    print "5. Images are served with ETags, 304 answers and ranges."
+
+
+if __name__ == '__main__':
+    try:
+        testConstantQueries()
+        testListColumns()
+        testKeysetPages()
+        testStreamedExports()
+        testImageCaching()
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(SCRATCH)
+    print "Success!  All tests pass!"
@@ -1,5 +1,5 @@
 import sys
-from sqlalchemy import Column, ForeignKey, Integer, String, BLOB
+from sqlalchemy import Column, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
@@ -30,14 +30,17 @@ class CategoryItem(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     description = Column(String(250), nullable=True)
-    image = Column(BLOB, nullable=True)
-    category_id = Column(Integer, ForeignKey('category.id'))
+    # SHA-256 and byte size of the image in image_store, NULL without one
+    image_hash = Column(String(64), nullable=True)
+    image_size = Column(Integer, nullable=True)
+    category_id = Column(Integer, ForeignKey('category.id'), index=True)
     category = relationship(Category)
 
     # Serialize all the required attributes
     @property
     def serialize(self):
         return{
+            'id': self.id,
             'name': self.name,
             'description': self.description,
             'category_id': self.category_id,
@@ -0,0 +1,69 @@
+import hashlib
+import imghdr
+import os
+import tempfile
+
+# Folder of the stored images, one file per distinct image content
+IMAGE_FOLDER = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), 'images'))
+# Permissions of the stored image files, readable by everyone
+IMAGE_MODE = 0o644
+# MIME types of the image formats imghdr recognizes
+MIME_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tiff': 'image/tiff',
+    'webp': 'image/webp',
+    'xbm': 'image/x-xbitmap',
+}
+
+
+def image_hash(data):
+    '''Return the hex SHA-256 digest that addresses the image data'''
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_path(digest):
+    '''Return the path of the file storing the image with the given hash'''
+    # Spread the files over 256 sub folders to keep the folders small
+    return os.path.join(IMAGE_FOLDER, digest[:2], digest)
+
+
+def save_image(data):
+    '''Store image data unless the same image is stored already
+
+    Returns a (hash, size) tuple to keep on the item.
+    '''
+    digest = image_hash(data)
+    path = image_path(digest)
+    if not os.path.exists(path):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created by a concurrent upload
+                if not os.path.isdir(folder):
+                    raise
+        # Write to a temporary file first so a half written image is never
+        # served under its hash
+        handle, temp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+        # mkstemp creates the file readable by its owner only, the web or
+        # static file server may run as another user
+        os.chmod(temp_path, IMAGE_MODE)
+        os.rename(temp_path, path)
+    return digest, len(data)
+
+
+def image_mimetype(digest):
+    '''Return the MIME type of the stored image, sniffed from its header
+
+    Unknown formats are application/octet-stream, so browsers download
+    them instead of rendering them.
+    '''
+    return MIME_TYPES.get(imghdr.what(image_path(digest)),
+                          'application/octet-stream')
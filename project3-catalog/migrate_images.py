@@ -0,0 +1,82 @@
+'''Move the item images out of the category_item table into image_store
+
+Adds the image_hash and image_size columns when they are missing, writes
+every image BLOB to the store and clears the BLOB, one item at a time so
+the images never all sit in memory. Running it again only moves the
+images left over.
+
+usage: python migrate_images.py [--database URL] [--vacuum]
+'''
+import argparse
+
+from sqlalchemy import create_engine, inspect, text
+
+import image_store
+
+# Database migrated when no --database is given, the one of application.py
+DATABASE_URL = 'sqlite:///catalog.db'
+
+
+def add_columns(connection):
+    '''Add the image_hash and image_size columns unless they exist
+
+    Returns True when the table still has the old image BLOB column.
+    '''
+    columns = set(column['name'] for column
+                  in inspect(connection).get_columns('category_item'))
+    if 'image_hash' not in columns:
+        connection.execute(text(
+            'ALTER TABLE category_item ADD COLUMN image_hash VARCHAR(64)'))
+    if 'image_size' not in columns:
+        connection.execute(text(
+            'ALTER TABLE category_item ADD COLUMN image_size INTEGER'))
+    return 'image' in columns
+
+
+def move_images(connection):
+    '''Move every image BLOB to the store
+
+    Returns a (count, size) tuple of the images moved and their bytes.
+    '''
+    item_ids = [row[0] for row in connection.execute(text(
+        'SELECT id FROM category_item WHERE image IS NOT NULL'))]
+    count = size = 0
+    for item_id in item_ids:
+        image = connection.execute(
+            text('SELECT image FROM category_item WHERE id = :id'),
+            id=item_id).scalar()
+        digest, image_size = image_store.save_image(bytes(image))
+        # The BLOB is only cleared once its file is written
+        with connection.begin():
+            connection.execute(
+                text('UPDATE category_item SET image_hash = :hash, '
+                     'image_size = :size, image = NULL WHERE id = :id'),
+                hash=digest, size=image_size, id=item_id)
+        count += 1
+        size += image_size
+    return count, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', default=DATABASE_URL,
+                        help='SQLAlchemy URL of the catalog database')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='give the space of the moved images back to '
+                             'the file system (SQLite only)')
+    args = parser.parse_args()
+    engine = create_engine(args.database)
+    connection = engine.connect()
+    if add_columns(connection):
+        count, size = move_images(connection)
+        print 'Moved %d images (%d bytes) to %s' % (
+            count, size, image_store.IMAGE_FOLDER)
+    else:
+        print 'No image column left to migrate'
+    if args.vacuum:
+        connection.execute(text('VACUUM'))
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()